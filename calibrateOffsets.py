@@ -0,0 +1,199 @@
+#----------------------------
+# This script estimates the daily Ze offsets of the X- and W-Band
+# relative to the Ka-Band from the DWR in rain-free, low
+# reflectivity regions close to cloud top, where all radars
+# should measure the same Ze (Rayleigh regime).
+# The days are processed in parallel and in hourly chunks, the
+# resulting table is applied by tripex_pol_plots.py
+# OPTIMIce Emmy-Noether Group
+# Institute for Geophysics and Meteorology
+# University of Cologne
+#----------------------------
+
+
+from sys import argv
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import numpy as np
+import xarray as xr
+import os
+import fileLib as fl
+
+'''
+input:
+startDate: first date that you want to have processed
+endDate: last date that you want to have processed
+dataPath: path where the resampled data are stored
+dataPathOutput: path where to put the offset table
+nProc: optional, number of days processed in parallel (default 4)
+'''
+
+# name of the offset table, it is read by tripex_pol_plots.py
+offsetFileName = 'dwr_offsets.csv'
+
+# selection of the calibration region
+maxZeKa = -10 # only low reflectivities (Rayleigh regime) [dB]
+minZeKa = -30 # avoid noisy data close to the sensitivity limit [dB]
+cloudTopDepth = 720 # depth of the region below the echo top [m]
+minHeight = 1000 # avoid clutter and melting layer close to the ground [m]
+# a profile is considered as rain if the Ka-Band fall velocity in the lowest
+# levels is faster than this value
+rainHeight = [200, 1000] # [m]
+rainVelocity = -2.5 # [m/s]
+
+# DWR histogram used for estimating the offset
+dwrBins = np.arange(-15, 15.01, 0.05)
+minCount = 1000 # minimum number of values to estimate an offset
+
+# number of time steps processed at once (1 hour of the 4 s grid)
+chunkSize = 900
+
+
+def getCalibrationMask(zeKa, velKa, rangeGrid):
+	"""
+	Selects the rain-free, low reflectivity regions close to cloud top
+
+	Parameters
+	----------
+	zeKa: Ka-Band Zg (array[time, range])
+	velKa: Ka-Band VELg (array[time, range])
+	rangeGrid: range grid of the data (array[range])
+
+	Returns
+	-------
+	mask: boolean array[time, range], True for calibration gates
+	"""
+	valid = np.isfinite(zeKa)
+	# echo top: highest gate with a valid Ka-Band signal
+	topIndex = len(rangeGrid) - 1 - np.argmax(valid[:, ::-1], axis=1)
+	echoTop = np.where(valid.any(axis=1), rangeGrid[topIndex], -np.inf)
+	nearTop = rangeGrid[np.newaxis, :] >= (echoTop[:, np.newaxis] - cloudTopDepth)
+
+	rainLevels = (rangeGrid >= rainHeight[0]) & (rangeGrid <= rainHeight[1])
+	with np.errstate(invalid='ignore'):
+		rain = np.any(velKa[:, rainLevels] < rainVelocity, axis=1)
+		lowZe = (zeKa >= minZeKa) & (zeKa <= maxZeKa)
+
+	mask = valid & lowZe & nearTop & ~rain[:, np.newaxis] & (rangeGrid[np.newaxis, :] >= minHeight)
+
+	return mask
+
+
+def addHist(hist, values):
+	"""
+	Adds the finite values to the DWR histogram (in place)
+	"""
+	values = values[np.isfinite(values)]
+	binIndex = np.searchsorted(dwrBins, values, side='right') - 1
+	binIndex = binIndex[(binIndex >= 0) & (binIndex < len(hist))]
+	hist += np.bincount(binIndex, minlength=len(hist))
+	return None
+
+
+def getHistMedian(hist):
+	"""
+	Median of the DWR histogram, nan if there are not enough values
+	"""
+	count = hist.sum()
+	if count < minCount:
+		return np.nan
+	binCenter = (dwrBins[:-1] + dwrBins[1:])/2
+	return binCenter[np.searchsorted(np.cumsum(hist), count/2)]
+
+
+def calibrateDay(date, dataPath):
+	"""
+	Calculates the DWR histograms and offsets of one day
+
+	Parameters
+	----------
+	date: date that you want to have processed (pandas Timestamp)
+	dataPath: path where the resampled data are stored
+
+	Returns
+	-------
+	offsets: dictionary with the date, the offsets and the number
+		of values used for the X-Ka and Ka-W DWR
+	"""
+	strDate = date.strftime('%Y%m%d')
+	bands = {'rad10':'X', 'rad35':'Ka', 'rad94':'W'}
+	varNames = {'rad10':['Zg'], 'rad35':['Zg','VELg'], 'rad94':['Ze']}
+	dataList = {}
+	# the opened datasets are kept for closing, the variable subsets can not close the file
+	opened = []
+	for rad in bands.keys():
+		filePath = fl.getResampledFileName(bands[rad], date, dataPath)
+		if os.path.exists(filePath):
+			opened.append(xr.open_dataset(filePath))
+			dataList[rad] = opened[-1][varNames[rad]]
+
+	histXKa = np.zeros(len(dwrBins)-1, dtype=np.int64)
+	histKaW = np.zeros(len(dwrBins)-1, dtype=np.int64)
+	if 'rad35' in dataList:
+		rangeGrid = dataList['rad35'].range.values
+		for start in range(0, dataList['rad35'].sizes['time'], chunkSize):
+			# only one hour of the day is in memory at once
+			chunk = {rad:dataList[rad].isel(time=slice(start, start+chunkSize)) for rad in dataList.keys()}
+			zeKa = chunk['rad35']['Zg'].values
+			mask = getCalibrationMask(zeKa, chunk['rad35']['VELg'].values, rangeGrid)
+			if 'rad10' in chunk:
+				addHist(histXKa, (chunk['rad10']['Zg'].values - zeKa)[mask])
+			if 'rad94' in chunk:
+				addHist(histKaW, (zeKa - chunk['rad94']['Ze'].values)[mask])
+
+	for data in opened:
+		data.close()
+
+	# the Ka-Band is the reference, DWR in the Rayleigh regime should be 0 dB
+	offsets = {'date':strDate,
+	           'offsetX':-getHistMedian(histXKa),
+	           'offsetKa':0.0,
+	           'offsetW':getHistMedian(histKaW),
+	           'countXKa':histXKa.sum(),
+	           'countKaW':histKaW.sum()}
+	print(offsets)
+
+	return offsets
+
+
+def calibrateDays(startDate, endDate, dataPath, dataPathOutput, nProc=4):
+	"""
+	Calculates the offsets of all days of a period in parallel and
+	updates the offset table
+
+	Parameters
+	----------
+	startDate: first date that you want to have processed (pandas Timestamp)
+	endDate: last date that you want to have processed (pandas Timestamp)
+	dataPath: path where the resampled data are stored
+	dataPathOutput: path where to put the offset table
+	nProc: number of days processed in parallel
+
+	Returns
+	-------
+	offsetTable: pandas dataframe of the offsets (index: date)
+	"""
+	dates = pd.date_range(startDate, endDate, freq='D')
+	with ProcessPoolExecutor(max_workers=nProc) as executor:
+		offsetList = list(executor.map(calibrateDay, dates, [dataPath]*len(dates)))
+
+	offsetTable = pd.DataFrame(offsetList).set_index('date')
+	filePath = ('/').join([dataPathOutput, offsetFileName])
+	# days which were calibrated before are kept, recalculated days are replaced
+	if os.path.exists(filePath):
+		oldTable = pd.read_csv(filePath, index_col='date', dtype={'date':str})
+		offsetTable = pd.concat([oldTable.drop(offsetTable.index, errors='ignore'), offsetTable]).sort_index()
+	offsetTable.to_csv(filePath)
+	print(filePath)
+
+	return offsetTable
+
+
+if __name__ == '__main__':
+	scriptname, startDate, endDate, dataPath, dataPathOutput = argv[:5]
+	nProc = int(argv[5]) if len(argv) > 5 else 4
+	startDate = pd.to_datetime(startDate)
+	endDate = pd.to_datetime(endDate)
+
+	calibrateDays(startDate, endDate, dataPath, dataPathOutput, nProc)
+
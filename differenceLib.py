@@ -0,0 +1,232 @@
+#----------------------------
+# This script contains the functions used for
+# calculating and storing the dual frequency
+# difference products (DWR, DDV, DSW) of the
+# resampled data
+# OPTIMIce Emmy-Noether Group
+# Institute for Geophysics and Meteorology
+# University of Cologne
+#----------------------------
+
+
+import numpy as np
+import xarray as xr
+import os
+import fileLib as fl
+import resampleLib as rspl
+
+
+# names of the difference products of each moment
+diffNames = {'Zg':'DWR', 'VELg':'DDV', 'RMSg':'DSW'}
+
+# radar pairs of the difference products
+radarPairs = {'XKa':('rad10', 'rad35'), 'KaW':('rad35', 'rad94')}
+
+# offset of each radar (see calibrateOffsets.py), only applied to Zg
+offsetNames = {'rad10':'offsetX', 'rad35':'offsetKa', 'rad94':'offsetW'}
+
+
+def getDiffFileName(dataPath, date):
+    """
+    Defines the name of the daily difference product file
+
+    Parameters
+    ----------
+    dataPath: path where the resampled data are stored
+    date: date of the data (pandas Timestamp)
+
+    Returns
+    -------
+    filePath: path of the difference product file
+
+    """
+
+    fileName = date.strftime('%Y%m%d')+'_diff_products.nc'
+    filePath = ('/').join([dataPath, fileName])
+
+    return filePath
+
+
+def getSourceSignature(fileList, offsets):
+    """
+    Describes the input of the difference products, so that they
+    are only recalculated if an input file or an offset changes
+
+    Parameters
+    ----------
+    fileList: list of the resampled band files
+    offsets: dictionary of the Ze offsets
+
+    Returns
+    -------
+    signature: string of the file names, sizes, modification
+        times and offsets
+
+    """
+
+    signature = []
+    for filePath in fileList:
+        if os.path.exists(filePath):
+            fileStat = os.stat(filePath)
+            signature.append('{0}:{1}:{2}'.format(os.path.basename(filePath),
+                                                  fileStat.st_size, fileStat.st_mtime_ns))
+        else:
+            signature.append('{0}:missing'.format(os.path.basename(filePath)))
+    for offset in sorted(offsets.keys()):
+        signature.append('{0}:{1}'.format(offset, offsets[offset]))
+
+    return ';'.join(signature)
+
+
+def sameGrid(dataList):
+    """
+    Checks if all datasets are on exactly the same time/range grid
+
+    Parameters
+    ----------
+    dataList: dictionary of xarray datasets (key: radar name)
+
+    Returns
+    -------
+    True if the grids are identical, else False
+
+    """
+
+    dataRef = list(dataList.values())[0]
+    for data in dataList.values():
+        for dim in ['time', 'range']:
+            if not np.array_equal(data[dim].values, dataRef[dim].values):
+                return False
+
+    return True
+
+
+def calcDiffProducts(dataList, offsets):
+    """
+    Calculates the difference products. If the grids are identical
+    the raw arrays are subtracted without aligning the coordinates
+
+    Parameters
+    ----------
+    dataList: dictionary of xarray datasets (keys: rad10, rad35, rad94)
+    offsets: dictionary of the Ze offsets (offsetX, offsetKa, offsetW)
+
+    Returns
+    -------
+    diffData: xarray dataset with the variables {DWR,DDV,DSW}_{XKa,KaW}
+        and the combined quality control flags qc_flag_{XKa,KaW}
+
+    """
+
+    alignedGrid = sameGrid(dataList)
+    dataRef = dataList['rad35']
+    diffData = xr.Dataset(coords={'time':dataRef.time.values, 'range':dataRef.range.values})
+
+    for var in diffNames.keys():
+        for pair in radarPairs.keys():
+            rad1, rad2 = radarPairs[pair]
+            if var == 'Zg':
+                offset = offsets[offsetNames[rad1]] - offsets[offsetNames[rad2]]
+            else:
+                offset = 0
+            name = diffNames[var]+'_'+pair
+            if alignedGrid:
+                values1 = dataList[rad1][var].transpose('time', 'range').values
+                values2 = dataList[rad2][var].transpose('time', 'range').values
+                diffData[name] = (('time', 'range'), values1 - values2 + offset)
+            else:
+                diffData[name] = (dataList[rad1][var] - dataList[rad2][var] + offset).transpose('time', 'range')
+            diffData[name].attrs['long_name'] = name
+            diffData[name].attrs['units'] = dataList[rad1][var].attrs.get('units', '')
+
+    # the quality control flags of the resampling are combined, not recalculated
+    for pair in radarPairs.keys():
+        rad1, rad2 = radarPairs[pair]
+        if 'qc_flag' in dataList[rad1] and 'qc_flag' in dataList[rad2]:
+            name = 'qc_flag_'+pair
+            if alignedGrid:
+                diffData[name] = (('time', 'range'), dataList[rad1]['qc_flag'].transpose('time', 'range').values |
+                                                     dataList[rad2]['qc_flag'].transpose('time', 'range').values)
+            else:
+                diffData[name] = (dataList[rad1]['qc_flag'] | dataList[rad2]['qc_flag']).transpose('time', 'range')
+            diffData[name].attrs = dataList[rad1]['qc_flag'].attrs
+
+    return diffData
+
+
+def hasSourceFiles(fileList):
+    """
+    Checks if at least one of the resampled band files exists,
+    otherwise the difference products are not worth storing
+    """
+    return any(os.path.exists(filePath) for filePath in fileList)
+
+
+def writeDiffProducts(diffData, filePath, signature):
+    """
+    Saves the difference products into a zlib compressed netCDF
+    file, with the same chunks as the moments (rspl.getEncoding)
+
+    Parameters
+    ----------
+    diffData: output from calcDiffProducts
+    filePath: path of the netCDF file
+    signature: output from getSourceSignature
+
+    Returns
+    -------
+    no returned value
+
+    """
+
+    diffData.attrs['source'] = signature
+    print(filePath)
+    encoding = rspl.getEncoding(diffData)
+    # the products may be written on a background thread
+    with fl.netcdfLock:
+        if os.path.exists(filePath):
+            os.remove(filePath)
+        diffData.to_netcdf(filePath, encoding=encoding)
+
+    return None
+
+
+def getDiffProducts(date, dataPath, dataList, offsets, fileList):
+    """
+    Returns the difference products of one day. They are read from
+    the difference product file if it was calculated from the same
+    input, otherwise they are calculated and the file is written
+    (if at least one of the band files exists)
+
+    Parameters
+    ----------
+    date: date of the data (pandas Timestamp)
+    dataPath: path where the resampled data are stored
+    dataList: dictionary of xarray datasets (keys: rad10, rad35, rad94)
+    offsets: dictionary of the Ze offsets (offsetX, offsetKa, offsetW)
+    fileList: list of the resampled band files
+
+    Returns
+    -------
+    diffData: xarray dataset of the difference products
+
+    """
+
+    filePath = getDiffFileName(dataPath, date)
+    signature = getSourceSignature(fileList, offsets)
+    if os.path.exists(filePath):
+        try:
+            with fl.netcdfLock:
+                diffData = xr.open_dataset(filePath)
+                if diffData.attrs.get('source') == signature:
+                    return diffData
+                diffData.close()
+        except:
+            print('cannot open ',filePath)
+
+    diffData = calcDiffProducts(dataList, offsets)
+    # days without any band file are not stored
+    if hasSourceFiles(fileList):
+        writeDiffProducts(diffData, filePath, signature)
+
+    return diffData
@@ -0,0 +1,30 @@
+#----------------------------
+# This script reports the per-hour time lag and range offset
+# of one resampled band relative to another one
+# OPTIMIce Emmy-Noether Group
+# Institute for Geophysics and Meteorology
+# University of Cologne
+#----------------------------
+
+
+from sys import argv
+import pandas as pd
+import lagLib as lag
+
+'''
+input:
+date: date that you want to have processed
+dataPath: path where the resampled data are stored
+band: band to be checked (X, Ka or W)
+refBand: reference band (X, Ka or W)
+'''
+
+if __name__ == '__main__':
+	scriptname, date, dataPath, band, refBand = argv
+	date = pd.to_datetime(date)
+
+	drift = lag.estimateBandDrift(dataPath, date, band, refBand)
+	if drift is not None:
+		timeLag, rangeLag = lag.getCorrection(drift)
+		print('daily correction of ',band,': time lag ',timeLag,' s, range offset ',rangeLag,' m')
+
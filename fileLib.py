@@ -0,0 +1,97 @@
+#----------------------------
+# This script contains the file patterns of the radar
+# data and of the resampled files, the function used for
+# listing the files of one day and the lock of the netCDF
+# file access. Only the standard library is used, so that
+# the command line entry point (quicklooks.py) can check
+# for input files without importing numpy/xarray
+# OPTIMIce Emmy-Noether Group
+# Institute for Geophysics and Meteorology
+# University of Cologne
+#----------------------------
+
+
+import glob
+import threading
+
+
+# input files of the radars, {path} and the date fields are filled by getFileList
+xkaFilePattern = '{path}/{year}/{month}/{day}/{date}_??????.znc'
+wbandFilePattern = '{path}/{year}/{month}/{day}/*.nc'
+rhiFilePattern = '{path}/{year}/{month}/{day}/*RHI*.nc'
+
+# resampled files of the bands, {path}, {date} (%Y%m%d) and the scan
+# type of the W-Band are filled by getResampledFileName
+resampledFilePatterns = {'X':'{path}/{date}_mom_X-band.nc',
+                         'Ka':'{path}/{date}_mom_Ka-band.nc',
+                         'W':'{path}/{date}_{scan}_moments_wband_scan.nc'}
+
+# netCDF-C/HDF5 are not thread-safe and xarray does not lock while
+# opening a file, so every open, load and write of netCDF files done
+# on more than one thread holds this lock (reentrant)
+netcdfLock = threading.RLock()
+
+
+def getFileList(pattern, date, dataPath):
+    """
+    Lists the files of one day, only the standard library is used
+
+    Parameters
+    ----------
+    pattern: file pattern (e.g. xkaFilePattern)
+    date: date of the files (datetime or pandas Timestamp)
+    dataPath: path where the data are stored
+
+    Returns
+    -------
+    fileList: sorted list of the files
+
+    """
+
+    filePath = pattern.format(path=dataPath,
+                              year=date.strftime('%Y'),
+                              month=date.strftime('%m'),
+                              day=date.strftime('%d'),
+                              date=date.strftime('%Y%m%d'))
+
+    return sorted(glob.glob(filePath))
+
+
+def getResampledFileName(band, date, dataPath, scan='ZEN'):
+    """
+    Defines the name of the resampled file of one band and day
+
+    Parameters
+    ----------
+    band: X, Ka or W
+    date: date of the file (datetime or pandas Timestamp)
+    dataPath: path where the resampled data are stored
+    scan: scan type of the W-Band (default: ZEN)
+
+    Returns
+    -------
+    filePath: path of the resampled file
+
+    """
+
+    return resampledFilePatterns[band].format(path=dataPath,
+                                              date=date.strftime('%Y%m%d'),
+                                              scan=scan)
+
+
+def getResampledFileList(date, dataPath):
+    """
+    Defines the names of the resampled X-, Ka- and W-Band files of one day
+
+    Parameters
+    ----------
+    date: date of the files (datetime or pandas Timestamp)
+    dataPath: path where the resampled data are stored
+
+    Returns
+    -------
+    fileList: paths of the X-, Ka- and W-Band files
+
+    """
+
+    return [getResampledFileName(band, date, dataPath) for band in ['X', 'Ka', 'W']]
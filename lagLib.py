@@ -0,0 +1,281 @@
+#----------------------------
+# This script contains the functions used for
+# estimating the time lag and range offset between
+# two resampled radars from the cross-correlation
+# of their reflectivities
+# OPTIMIce Emmy-Noether Group
+# Institute for Geophysics and Meteorology
+# University of Cologne
+#----------------------------
+
+
+import pandas as pd
+import numpy as np
+import xarray as xr
+import os
+import fileLib as fl
+
+
+# reflectivity name in the resampled file of each band
+bandVariables = {'X':'Zg', 'Ka':'Zg', 'W':'Ze'}
+
+# default settings of the lag estimation (in grid steps)
+windowSize = 900 # length of the sliding window (1 hour of the 4 s grid)
+windowStep = 900 # step of the sliding window
+maxTimeLag = 15 # maximum time lag searched (60 s)
+maxRangeLag = 3 # maximum range lag searched (108 m)
+minOverlap = 1000 # minimum number of gates with signal in both radars
+minCorrelation = 0.5 # windows with a lower correlation are not used
+
+
+def crossCorrelateFFT(ze1, ze2, maxTimeLag=maxTimeLag, maxRangeLag=maxRangeLag):
+    """
+    Calculates the normalized 2D cross-correlation of two reflectivity
+    fields for all time and range lags at once using FFTs. Gates without
+    signal (nan) are excluded by correlating the masks as well
+
+    Parameters
+    ----------
+    ze1, ze2: reflectivity in dB on the same grid (array[time, range])
+    maxTimeLag: maximum time lag in grid steps
+    maxRangeLag: maximum range lag in grid steps
+
+    Returns
+    -------
+    corr: correlation coefficient (array[2*maxTimeLag+1, 2*maxRangeLag+1]),
+        corr[maxTimeLag+k, maxRangeLag+l] is the correlation of
+        ze1[t, r] with ze2[t+k, r+l]
+    overlap: number of gates with signal in both radars for each lag
+
+    """
+
+    valid1 = np.isfinite(ze1)
+    valid2 = np.isfinite(ze2)
+    if not valid1.any() or not valid2.any():
+        corr = np.full((2*maxTimeLag+1, 2*maxRangeLag+1), np.nan)
+        return corr, np.zeros(corr.shape)
+    anom1 = np.where(valid1, ze1 - np.nanmean(ze1), 0)
+    anom2 = np.where(valid2, ze2 - np.nanmean(ze2), 0)
+
+    # zero padding, so that the circular correlation is not wrapped
+    shape = (ze1.shape[0] + maxTimeLag + 1, ze1.shape[1] + maxRangeLag + 1)
+
+    def correlate(a, b):
+        return np.fft.irfft2(np.conj(np.fft.rfft2(a, s=shape))*np.fft.rfft2(b, s=shape), s=shape)
+
+    def lagWindow(c):
+        timeIndex = np.arange(-maxTimeLag, maxTimeLag+1) % shape[0]
+        rangeIndex = np.arange(-maxRangeLag, maxRangeLag+1) % shape[1]
+        return c[np.ix_(timeIndex, rangeIndex)]
+
+    mask1 = valid1.astype(np.float64)
+    mask2 = valid2.astype(np.float64)
+    cross = lagWindow(correlate(anom1, anom2))
+    overlap = np.rint(lagWindow(correlate(mask1, mask2)))
+    sumSq1 = lagWindow(correlate(anom1**2, mask2))
+    sumSq2 = lagWindow(correlate(mask1, anom2**2))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        corr = cross/np.sqrt(sumSq1*sumSq2)
+    corr[overlap < minOverlap] = np.nan
+
+    return corr, overlap
+
+
+def getPeak(corr, maxTimeLag=maxTimeLag, maxRangeLag=maxRangeLag):
+    """
+    Finds the maximum of the correlation with sub-grid accuracy
+    (parabolic interpolation in time and range)
+
+    Parameters
+    ----------
+    corr: output from crossCorrelateFFT
+
+    Returns
+    -------
+    timeLag, rangeLag: lag of the maximum in grid steps (nan if no valid lag)
+    corrMax: correlation at the maximum
+
+    """
+
+    if not np.any(np.isfinite(corr)):
+        return np.nan, np.nan, np.nan
+    it, ir = np.unravel_index(np.nanargmax(corr), corr.shape)
+
+    def parabolic(cm, c0, cp):
+        denom = cm - 2*c0 + cp
+        if not np.isfinite(denom) or denom >= 0:
+            return 0.0
+        return 0.5*(cm - cp)/denom
+
+    timeLag = it - maxTimeLag
+    rangeLag = ir - maxRangeLag
+    if 0 < it < corr.shape[0]-1:
+        timeLag += parabolic(corr[it-1, ir], corr[it, ir], corr[it+1, ir])
+    if 0 < ir < corr.shape[1]-1:
+        rangeLag += parabolic(corr[it, ir-1], corr[it, ir], corr[it, ir+1])
+
+    return timeLag, rangeLag, corr[it, ir]
+
+
+def estimateDrift(data1, data2, zeName1='Zg', zeName2='Zg',
+                  windowSize=windowSize, windowStep=windowStep):
+    """
+    Estimates the time lag and range offset of radar 1 relative to
+    radar 2 in sliding windows (per hour by default)
+
+    Parameters
+    ----------
+    data1, data2: resampled xarray datasets on the same grid
+    zeName1, zeName2: names of the reflectivity variables
+    windowSize: length of the sliding window in time steps
+    windowStep: step of the sliding window in time steps
+
+    Returns
+    -------
+    drift: pandas dataframe (index: window center) with timeLag [s],
+        rangeLag [m], correlation and overlap. Adding timeLag to the
+        time and rangeLag to the range of radar 1 aligns it with radar 2
+
+    """
+
+    ze1 = data1[zeName1].transpose('time', 'range').values
+    ze2 = data2[zeName2].transpose('time', 'range').values
+    timeGrid = pd.to_datetime(data1.time.values)
+    timeStep = (timeGrid[1] - timeGrid[0]).total_seconds()
+    rangeStep = float(data1.range.values[1] - data1.range.values[0])
+
+    drift = []
+    for start in range(0, max(len(timeGrid) - windowSize, 0) + 1, windowStep):
+        window = slice(start, start+windowSize)
+        corr, overlap = crossCorrelateFFT(ze1[window], ze2[window])
+        timeLag, rangeLag, corrMax = getPeak(corr)
+        center = timeGrid[min(start + windowSize//2, len(timeGrid)-1)]
+        drift.append({'time':center,
+                      'timeLag':timeLag*timeStep,
+                      'rangeLag':rangeLag*rangeStep,
+                      'correlation':corrMax,
+                      'overlap':np.nanmax(overlap) if overlap.size else 0})
+
+    drift = pd.DataFrame(drift).set_index('time')
+
+    return drift
+
+
+def getCorrection(drift):
+    """
+    Combines the windows of a day into one time lag and range offset
+    correction (median of the windows with a good correlation)
+
+    Parameters
+    ----------
+    drift: output from estimateDrift
+
+    Returns
+    -------
+    timeLag: time correction [s] (0 if no window is usable)
+    rangeLag: range correction [m] (0 if no window is usable)
+
+    """
+
+    good = drift[drift['correlation'] >= minCorrelation]
+    if good.empty:
+        return 0.0, 0.0
+
+    return float(good['timeLag'].median()), float(good['rangeLag'].median())
+
+
+def getTimeLags(drift):
+    """
+    Selects the time lags of the windows with a good correlation,
+    they describe the clock drift during the day
+
+    Parameters
+    ----------
+    drift: output from estimateDrift
+
+    Returns
+    -------
+    timeLags: pandas series of the time lag [s] (index: window center),
+        empty if no window is usable
+
+    """
+
+    good = drift[(drift['correlation'] >= minCorrelation) & np.isfinite(drift['timeLag'])]
+
+    return good['timeLag']
+
+
+def interpTimeLag(timeLag, times):
+    """
+    Calculates the time correction of each radar time. The lags of
+    the windows are interpolated linearly, before the first and after
+    the last window the lag of that window is used
+
+    Parameters
+    ----------
+    timeLag: constant time lag [s] or output from getTimeLags
+    times: times of the radar (array of datetime64)
+
+    Returns
+    -------
+    timeShift: time correction [s] of each radar time (array)
+
+    """
+
+    if not isinstance(timeLag, pd.Series):
+        return np.full(len(times), float(timeLag))
+    if timeLag.empty:
+        return np.zeros(len(times))
+
+    windowTimes = pd.to_datetime(timeLag.index).values.astype('datetime64[ns]').astype(np.int64)
+    times = np.asarray(times).astype('datetime64[ns]').astype(np.int64)
+
+    return np.interp(times, windowTimes, timeLag.values.astype(np.float64))
+
+
+def estimateBandDrift(dataPath, date, band, refBand, data=None):
+    """
+    Estimates the per-hour drift of a resampled band relative to a
+    reference band and saves it as csv table next to the data
+
+    Parameters
+    ----------
+    dataPath: path where the resampled data are stored
+    date: date of the data (pandas Timestamp)
+    band: band to be checked (X, Ka or W)
+    refBand: reference band (X, Ka or W)
+    data: resampled dataset of band, if None it is read from dataPath
+
+    Returns
+    -------
+    drift: output from estimateDrift, None if a file does not exist
+
+    """
+
+    strDate = date.strftime('%Y%m%d')
+    dataList = {}
+    opened = []
+    try:
+        for b in [band, refBand]:
+            filePath = fl.getResampledFileName(b, date, dataPath)
+            if b == band and data is not None:
+                dataList[b] = data
+            elif os.path.exists(filePath):
+                dataList[b] = xr.open_dataset(filePath)
+                opened.append(dataList[b])
+            else:
+                print('no resampled file ', filePath)
+                return None
+
+        drift = estimateDrift(dataList[band], dataList[refBand],
+                              bandVariables[band], bandVariables[refBand])
+    finally:
+        for openedData in opened:
+            openedData.close()
+    print(drift)
+    driftFile = ('/').join([dataPath, '{0}_lag_{1}-{2}.csv'.format(strDate, band, refBand)])
+    drift.to_csv(driftFile)
+    print(driftFile)
+
+    return drift
@@ -12,10 +12,73 @@ import matplotlib
 matplotlib.use('Agg')
 
 import matplotlib.pyplot as plt 
-from sys import argv
-import pandas as pd
-import xarray as xr
 import numpy as np
+import os
+from collections import OrderedDict
+
+
+# default output options of all quicklooks, the plotting scripts can
+# override them per plot (options argument of saveFigure/plotVar/plotDiffVar)
+# format: png or webp
+# compressLevel: png compression (0-9), lower is faster but gives larger files
+# quality: webp quality (0-100)
+# tightBBox: crop the figure to the drawn area, with False the fixed
+#     figure layout is saved as it is
+# previews: smaller versions saved next to the quicklook, name: width in pixel
+saveOptions = {'format':'png', 'compressLevel':6, 'quality':90,
+               'tightBBox':True, 'previews':{}}
+
+def saveFigure(fig, filePathName, dpi=200, options=None):
+    """
+    It saves a figure and its previews. The figure is drawn only once,
+    the quicklook and all previews are encoded from the same image
+    buffer. The tight bounding box is cut out of the drawn buffer
+    instead of drawing the figure a second time
+
+    Parameters
+    ----------
+    fig: matplotlib figure
+    filePathName: path and name of the plot, the extension is
+        replaced by the one of the selected format
+    dpi: resolution of the plot (default: 200)
+    options: dictionary overriding entries of saveOptions
+
+    Returns
+    -------
+    no returned value
+    """
+    # Pillow comes with matplotlib, it is only needed once a figure is saved
+    from PIL import Image
+
+    options = dict(saveOptions, **(options or {}))
+    fig.set_dpi(dpi)
+    fig.canvas.draw()
+    image = Image.fromarray(np.asarray(fig.canvas.buffer_rgba()))
+
+    if options['tightBBox']:
+        # same padding as bbox_inches='tight' (0.1 inch)
+        bbox = fig.get_tightbbox(fig.canvas.get_renderer()).padded(0.1)
+        width, height = image.size
+        box = (max(int(np.floor(bbox.x0*dpi)), 0), max(int(np.floor(height - bbox.y1*dpi)), 0),
+               min(int(np.ceil(bbox.x1*dpi)), width), min(int(np.ceil(height - bbox.y0*dpi)), height))
+        image = image.crop(box)
+
+    fileFormat = options['format'].lower()
+    if fileFormat == 'webp':
+        saveArgs = {'format':'WEBP', 'quality':options['quality']}
+    else:
+        fileFormat = 'png'
+        image = image.convert('RGB')
+        saveArgs = {'format':'PNG', 'compress_level':options['compressLevel']}
+
+    fileBase = os.path.splitext(filePathName)[0]
+    image.save(fileBase+'.'+fileFormat, **saveArgs)
+    for previewName, previewWidth in options['previews'].items():
+        previewHeight = max(int(round(image.size[1]*previewWidth/image.size[0])), 1)
+        preview = image.resize((previewWidth, previewHeight), Image.LANCZOS)
+        preview.save(fileBase+'_'+previewName+'.'+fileFormat, **saveArgs)
+
+    return None
 
 
 def plotLDRWKa(data35, data94, vmax, vmin,
@@ -62,7 +125,7 @@ def plotLDRWKa(data35, data94, vmax, vmin,
     else:
         fileName = ('_').join([date,varName+'.png'])
     filePathName = ('/').join([pathOut,fileName])
-    plt.savefig(filePathName, format='png', dpi=200, bbox_inches='tight')
+    saveFigure(fig, filePathName)
 
     #plt.show()
     plt.close()
@@ -106,7 +169,7 @@ def plotLDR(data35, vmax, vmin,
  
     fileName = ('_').join([date,varName+'.png'])
     filePathName = ('/').join([pathOut,fileName])
-    plt.savefig(filePathName, format='png', dpi=200, bbox_inches='tight')
+    saveFigure(fig, filePathName)
 
     #plt.show()
     plt.close()
@@ -115,7 +178,7 @@ def plotLDR(data35, vmax, vmin,
 
 def plotVar(data35, data94,
             vmax, vmin, pathOut, date,
-            varName,units,CEL=True,data10=[],cmap='nipy_spectral'):
+            varName,units,CEL=True,data10=[],cmap='nipy_spectral',options=None):
     """
     It plots dual panels of a given variable
 
@@ -131,6 +194,7 @@ def plotVar(data35, data94,
     optional: 
     data10: xarray dataset of the resampled Joyrad10
     CEL: if the measurements are taken from the tripex-pol-scan CEL measurements
+    options: dictionary overriding entries of saveOptions
     Returns
     -------
     no returned value
@@ -171,7 +235,7 @@ def plotVar(data35, data94,
     else:
         fileName = ('_').join([date,varName+'.png'])
     filePathName = ('/').join([pathOut,fileName])
-    plt.savefig(filePathName, format='png', dpi=200, bbox_inches='tight')
+    saveFigure(fig, filePathName, options=options)
 
     #plt.show()
     plt.close()
@@ -181,7 +245,7 @@ def plotVar(data35, data94,
 
 def plotDiffVar(diff3594,
                 vmax, vmin, pathOut, date,
-                varName,units, CEL=True,diff1035=[],cmap='nipy_spectral'):
+                varName,units, CEL=True,diff1035=[],cmap='nipy_spectral',options=None):
 
     """
     It plots double panels differences of a given variable
@@ -195,6 +259,7 @@ def plotDiffVar(diff3594,
     pathOut: path to save the plot
     date: date of the plotting day
     varName: variable name in the xarray dataset
+    options: dictionary overriding entries of saveOptions
 
     Returns
     -------
@@ -247,7 +312,7 @@ def plotDiffVar(diff3594,
     else:
         fileName = ('_').join([date,varName+'.png'])
     filePathName = ('/').join([pathOut,fileName])
-    plt.savefig(filePathName, format='png', dpi=200, bbox_inches='tight')
+    saveFigure(fig, filePathName, options=options)
 
     #plt.show()
     plt.close()
@@ -274,64 +339,240 @@ def getNewNipySpectral():
 
     return newcmp
 
+# panels of the polarimetric quicklook, the colormap name is
+# taken from the colmap argument of plotPol (cmapSuffix is appended)
+polVariables = OrderedDict([('ZDR', {'lim':(-1,4), 'cmapSuffix':'', 'cbLabel':'ZDR [dB]'}),
+                            ('KDP', {'lim':(-1,4), 'cmapSuffix':'', 'cbLabel':r'KDP [°km$^{-1}$]'}),
+                            ('sZDRmax', {'lim':(-1,4), 'cmapSuffix':'', 'cbLabel':'sZDRmax [dB]'}),
+                            ('RHV', {'lim':(0.85,1.001), 'cmapSuffix':'_r', 'cbLabel':'RhoHV'})])
+
+# figure of the last polarimetric quicklook, it is reused by the next
+# call with the same grid (relative to its first time step), then
+# only the data of the meshes and the position of the time axis change
+polFigure = {}
+
 def plotPol(data,plotOutPath, strDate, plotID, colmap='gist_ncar'):
-    fig, axes = plt.subplots(nrows=4, figsize=(18,24))
-    radData = {'ZDR':{'data':data, 'axis':axes[0], 'lim':(-1,4),'cmap':colmap,'cbLabel':'ZDR [dB]'},
-               'KDP':{'data':data, 'axis':axes[1], 'lim':(-1,4), 'cmap':colmap,'cbLabel':r'KDP [°km$^{-1}$]'},
-               'sZDRmax':{'data':data, 'axis':axes[2], 'lim':(-1,4), 'cmap':colmap,'cbLabel':'sZDRmax [dB]'},
-               'RHV':{'data':data, 'axis':axes[3], 'lim':(0.85,1.001), 'cmap':colmap+'_r','cbLabel':'RhoHV'}}
-    for rad in radData.keys():
-        plot = radData[rad]['data'][rad].T.plot(ax=radData[rad]['axis'],
-                                           vmax=radData[rad]['lim'][1],
-                                           vmin=radData[rad]['lim'][0],
-                                           cmap=radData[rad]['cmap'],add_colorbar=False)
-        cb = plt.colorbar(plot,ax=radData[rad]['axis'])
-        cb.set_label(radData[rad]['cbLabel'],fontsize=18)
-        cb.ax.tick_params(labelsize=16)
-        radData[rad]['axis'].set_title(rad,fontsize=18)
-        plt.setp(plot.axes.xaxis.get_majorticklabels(), rotation=0)
-        radData[rad]['axis'].grid()
-        radData[rad]['axis'].set_xlabel('')
-        radData[rad]['axis'].tick_params(axis='y',labelsize=16)
-        radData[rad]['axis'].tick_params(axis='x',labelsize=16)
-        radData[rad]['axis'].set_ylabel('height [m]',fontsize=18)
-        plt.tight_layout()
+    """
+    It plots the four panels of the polarimetric variables. The
+    figure is kept open and reused for the next day on the same
+    grid, the meshes are only created again if the grid changes
+
+    Parameters
+    ----------
+    data: xarray dataset with ZDR, KDP, sZDRmax and RHV
+    plotOutPath: path to save the plot
+    strDate: date of the plotting day
+    plotID: name of the plot
+    colmap: colormap (default: gist_ncar)
+
+    Returns
+    -------
+    no returned value
+    """
+    import matplotlib.dates as mdates
+    import matplotlib.transforms as mtransforms
+
+    # the first dimension is on the x axis (same as .T.plot() of xarray)
+    dims = data['ZDR'].dims
+    xGrid = data[dims[0]].values
+    isTime = np.issubdtype(xGrid.dtype, np.datetime64)
+    if isTime:
+        xGrid = mdates.date2num(xGrid)
+    xGrid = np.asarray(xGrid, dtype=np.float64)
+    yGrid = np.asarray(data[dims[1]].values, dtype=np.float64)
+    # the meshes are drawn relative to the first time step and shifted
+    xStart = xGrid[0]
+    key = ((xGrid - xStart).tobytes(), yGrid.tobytes(), colmap, isTime)
+
+    if polFigure.get('key') != key:
+        if 'fig' in polFigure:
+            plt.close(polFigure['fig'])
+        fig, axes = plt.subplots(nrows=len(polVariables), figsize=(18,24))
+        meshes = OrderedDict()
+        for rad, ax in zip(polVariables.keys(), axes):
+            values = np.ma.masked_invalid(data[rad].transpose(*dims).values.T)
+            mesh = ax.pcolormesh(xGrid - xStart, yGrid, values,
+                                 vmax=polVariables[rad]['lim'][1],
+                                 vmin=polVariables[rad]['lim'][0],
+                                 cmap=colmap+polVariables[rad]['cmapSuffix'], shading='auto')
+            cb = fig.colorbar(mesh,ax=ax)
+            cb.set_label(polVariables[rad]['cbLabel'],fontsize=18)
+            cb.ax.tick_params(labelsize=16)
+            ax.set_title(rad,fontsize=18)
+            if isTime:
+                ax.xaxis_date()
+            ax.grid(True)
+            ax.set_xlabel('')
+            ax.tick_params(axis='y',labelsize=16)
+            ax.tick_params(axis='x',labelsize=16)
+            ax.set_ylabel('height [m]',fontsize=18)
+            meshes[rad] = mesh
+        polFigure.update({'key':key, 'fig':fig, 'meshes':meshes})
+    else:
+        fig, meshes = polFigure['fig'], polFigure['meshes']
+        for rad, mesh in meshes.items():
+            mesh.set_array(np.ma.masked_invalid(data[rad].transpose(*dims).values.T).ravel())
+
+    for mesh in meshes.values():
+        ax = mesh.axes
+        mesh.set_transform(mtransforms.Affine2D().translate(xStart, 0) + ax.transData)
+        ax.set_xlim(xGrid.min(), xGrid.max())
+        ax.set_ylim(yGrid.min(), yGrid.max())
+        plt.setp(ax.xaxis.get_majorticklabels(), rotation=0)
+    fig.tight_layout()
     plotFileName = ('_').join([strDate,plotID])
     filePathName = ('/').join([plotOutPath,plotFileName])
-    plt.savefig(filePathName+'.png',dpi=200, bbox_inches='tight')
-    plt.close()
+    saveFigure(fig, filePathName+'.png')
     return None
 
-def plot_RHI(data, variable_name, color_lim = [1, 2], colormap='gnuplot'):
+# cartesian meshes of the last RHI scan geometries (least recently
+# used meshes are removed), the elevations are rounded to
+# rhiElevationDecimals so that the jitter between scans does not matter
+rhiMeshCache = OrderedDict()
+rhiMeshCacheSize = 8
+rhiElevationDecimals = 2
 
-    fig,ax = plt.subplots(figsize=(18, 10))
-       
-    plt.pcolormesh(data['range']*np.cos(np.deg2rad(data['elevation'])), data['range']*np.sin(np.deg2rad(data['elevation'])), variable, shading='auto')
-    
-    plt.axis('scaled')
-    plt.clim(color_lim) 
-    #plt.colorbar()
-    plt.set_cmap(colormap)
-    #plt.title('RHI: '+variable_name + ' - ' + time[0].strftime("%d/%m/%Y, %H:%M"))
-    return fig
+def getRHIMeshKey(rangeGrid, elevation):
+    """
+    It returns the key of a RHI scan geometry (range and rounded
+    elevation grid), used by the mesh cache and by plotRHIs
+    """
+    rangeGrid = np.asarray(rangeGrid, dtype=np.float64)
+    elevation = np.round(np.asarray(elevation, dtype=np.float64), rhiElevationDecimals)
+    return (rangeGrid.tobytes(), elevation.tobytes())
 
-def getNewNipySpectral():
+def getRHIMesh(rangeGrid, elevation):
+    """
+    It converts the polar RHI geometry into the cartesian mesh. The
+    mesh is computed once per geometry and reused for all variables
+    and scans with the same range and (rounded) elevation grid
 
-    from matplotlib import cm
-    from matplotlib.colors import ListedColormap
+    Parameters
+    ----------
+    rangeGrid: range of the scan (array[m])
+    elevation: elevation angles of the scan in degree (array[n])
 
-    numEnt = 15
+    Returns
+    -------
+    x, y: horizontal distance and height (array[n, m])
+    """
+    key = getRHIMeshKey(rangeGrid, elevation)
+    if key in rhiMeshCache:
+        rhiMeshCache.move_to_end(key)
+    else:
+        rangeGrid = np.asarray(rangeGrid, dtype=np.float64)
+        elevation = np.round(np.asarray(elevation, dtype=np.float64), rhiElevationDecimals)
+        x = np.outer(np.cos(np.deg2rad(elevation)), rangeGrid)
+        y = np.outer(np.sin(np.deg2rad(elevation)), rangeGrid)
+        rhiMeshCache[key] = (x, y)
+        while len(rhiMeshCache) > rhiMeshCacheSize:
+            rhiMeshCache.popitem(last=False)
+    return rhiMeshCache[key]
+
+def plot_RHI(data, variable_name, color_lim = [1, 2], colormap='gnuplot', ax=None):
+    """
+    It plots one variable of a RHI scan
 
-    viridis = cm.get_cmap('nipy_spectral', 256)
-    newcolors = viridis(np.linspace(0, 1, 256))
+    Parameters
+    ----------
+    data: xarray dataset of the scan with the coordinates range and
+        elevation, the variable has the dimensions (elevation, range)
+    variable_name: variable name in the xarray dataset
+    color_lim: minimum and maximum color value
+    colormap: colormap (default: gnuplot)
+    ax: axis to plot into, if None a new figure is created
 
-    colorSpace = np.linspace(198, 144, numEnt)/256
-    colorTest=np.zeros((numEnt,4))
-    colorTest[:,3] = 1
-    colorTest[:,0]=colorSpace
+    Returns
+    -------
+    fig: the figure of the plot
+    """
+    if ax is None:
+        fig,ax = plt.subplots(figsize=(18, 10))
+    else:
+        fig = ax.figure
 
-    newcolors[- numEnt:, :] = colorTest
-    newcmp = ListedColormap(newcolors)
+    x, y = getRHIMesh(data['range'].values, data['elevation'].values)
+    values = data[variable_name].transpose('elevation', 'range').values
+    ax.pcolormesh(x, y, np.ma.masked_invalid(values), shading='auto',
+                  vmin=color_lim[0], vmax=color_lim[1], cmap=colormap)
 
-    return newcmp
+    ax.axis('scaled')
+    #plt.colorbar()
+    #plt.title('RHI: '+variable_name + ' - ' + time[0].strftime("%d/%m/%Y, %H:%M"))
+    return fig
 
+def plotRHIs(scanList, rhiVariables, plotOutPath, plotID='RHI'):
+    """
+    It plots all variables of all RHI scans of a day. One figure is
+    reused for all plots, it keeps one mesh per scan geometry (at most
+    rhiMeshCacheSize), so for a known geometry only the data and the
+    color limits of its mesh are replaced
+
+    Parameters
+    ----------
+    scanList: list of xarray datasets, one RHI scan each (coordinates
+        range and elevation, optional time)
+    rhiVariables: dictionary of the variables to plot, e.g.
+        {'ZDR':{'lim':(-1,4), 'cmap':'gist_ncar', 'cbLabel':'ZDR [dB]'}}
+    plotOutPath: path to save the plots
+    plotID: name of the plots (default: RHI)
+
+    Returns
+    -------
+    no returned value
+    """
+    import pandas as pd
+
+    fig, ax = plt.subplots(figsize=(18, 10))
+    ax.set_aspect('equal', adjustable='box')
+    ax.grid(True)
+    ax.set_xlabel('distance [m]',fontsize=18)
+    ax.set_ylabel('height [m]',fontsize=18)
+    ax.tick_params(axis='both',labelsize=16)
+    # meshes of the scan geometries, least recently used first
+    meshes = OrderedDict()
+    mesh = None
+    cb = None
+    for scanNum, data in enumerate(scanList):
+        key = getRHIMeshKey(data['range'].values, data['elevation'].values)
+        x, y = getRHIMesh(data['range'].values, data['elevation'].values)
+        if 'time' in data.coords:
+            strTime = pd.to_datetime(np.atleast_1d(data['time'].values)[0]).strftime('%Y%m%d_%H%M%S')
+        else:
+            strTime = str(scanNum)
+        for var in rhiVariables.keys():
+            if var not in data:
+                continue
+            values = np.ma.masked_invalid(data[var].transpose('elevation', 'range').values)
+            if key in meshes:
+                meshes.move_to_end(key)
+                meshes[key].set_array(values.ravel())
+            else:
+                # new geometry: a mesh is created for it
+                meshes[key] = ax.pcolormesh(x, y, values, shading='auto')
+                while len(meshes) > rhiMeshCacheSize:
+                    meshes.popitem(last=False)[1].remove()
+            if meshes[key] is not mesh:
+                # only the mesh of the current geometry is drawn, the
+                # axis limits are set from its mesh (the data limits of
+                # the axis still contain the other geometries)
+                for otherMesh in meshes.values():
+                    otherMesh.set_visible(otherMesh is meshes[key])
+                mesh = meshes[key]
+                ax.set_xlim(x.min(), x.max())
+                ax.set_ylim(y.min(), y.max())
+            mesh.set_cmap(rhiVariables[var]['cmap'])
+            mesh.set_clim(rhiVariables[var]['lim'])
+            if cb is None:
+                cb = fig.colorbar(mesh,ax=ax)
+                cb.ax.tick_params(labelsize=16)
+            else:
+                cb.update_normal(mesh)
+            cb.set_label(rhiVariables[var]['cbLabel'],fontsize=18)
+            ax.set_title('RHI: '+var+' - '+strTime,fontsize=18)
+
+            plotFileName = ('_').join([strTime,plotID,var])
+            filePathName = ('/').join([plotOutPath,plotFileName])
+            saveFigure(fig, filePathName+'.png')
+    plt.close(fig)
+    return None
@@ -0,0 +1,196 @@
+#----------------------------
+# Command line entry point of the resampling and plotting steps.
+# Only the standard library is imported at start, the inputs are
+# checked first and the heavy libraries (numpy, xarray, matplotlib,
+# netCDF4) are only imported if a step has something to do.
+#
+# python3 quicklooks.py [--profile-imports] resample DATE DATAPATH OUTPUTPATH BAND [--ref-band REFBAND]
+# python3 quicklooks.py [--profile-imports] wband DATE DATAPATH OUTPUTPATH [--nproc N]
+# python3 quicklooks.py [--profile-imports] plot DATE DATAPATH OUTPUTPATH EMPTYDATAPATH
+# python3 quicklooks.py [--profile-imports] rhi DATE DATAPATH OUTPUTPATH
+# python3 quicklooks.py [--profile-imports] serve DATAPATH EMPTYDATAPATH [--port PORT] [--cache-dir CACHEDIR]
+#
+# OPTIMIce Emmy-Noether Group
+# Institute for Geophysics and Meteorology
+# University of Cologne
+#----------------------------
+
+
+import argparse
+import datetime
+import importlib
+import os
+import sys
+import time
+import fileLib as fl
+
+
+# heavy libraries, with --profile-imports the import time of those
+# imported by the module of a step is reported
+heavyModules = ['numpy', 'pandas', 'xarray', 'netCDF4', 'matplotlib', 'PIL']
+
+
+def importStage(moduleName, profileImports=False):
+    """
+    Imports the module of a step, optionally reporting how long the
+    heavy libraries imported by it and the module itself take to import
+
+    Parameters
+    ----------
+    moduleName: name of the module of the step
+    profileImports: report the import times (default: False)
+
+    Returns
+    -------
+    module: the imported module
+
+    """
+
+    if not profileImports:
+        return importlib.import_module(moduleName)
+
+    import builtins
+
+    # import time of each heavy library without the heavy libraries
+    # imported by it, they are reported on their own
+    timings = {}
+    # heavy imports in progress: [library, time of the nested heavy imports]
+    stack = []
+    builtinImport = builtins.__import__
+
+    def timedImport(name, globals=None, locals=None, fromlist=(), level=0):
+        library = name.split('.')[0]
+        if level != 0 or library not in heavyModules or name in sys.modules:
+            return builtinImport(name, globals, locals, fromlist, level)
+        stack.append([library, 0.0])
+        start = time.perf_counter()
+        try:
+            return builtinImport(name, globals, locals, fromlist, level)
+        finally:
+            duration = time.perf_counter() - start
+            timings[library] = timings.get(library, 0.0) + duration - stack.pop()[1]
+            if stack:
+                stack[-1][1] += duration
+
+    start = time.perf_counter()
+    builtins.__import__ = timedImport
+    try:
+        module = importlib.import_module(moduleName)
+    finally:
+        builtins.__import__ = builtinImport
+    total = time.perf_counter() - start
+
+    for name in heavyModules:
+        if name in timings:
+            print('import {0:<22} {1:8.3f} s'.format(name, timings[name]), file=sys.stderr)
+    print('import {0:<22} {1:8.3f} s'.format(moduleName, total - sum(timings.values())), file=sys.stderr)
+    print('import {0:<22} {1:8.3f} s'.format('total', total), file=sys.stderr)
+
+    return module
+
+
+def runResample(args):
+    if not fl.getFileList(fl.xkaFilePattern, args.date, args.dataPath):
+        print('no files found ', args.date.strftime('%Y%m%d'))
+        return 0
+    rsx = importStage('resampleXKaBand', args.profile_imports)
+    rsx.run(args.date, args.dataPath, args.dataPathOutput, args.band, args.ref_band)
+    return 0
+
+
+def runWband(args):
+    if not fl.getFileList(fl.wbandFilePattern, args.date, args.dataPath):
+        print('no files found ', args.date.strftime('%Y%m%d'))
+        return 0
+    rsw = importStage('resampleWbandScan', args.profile_imports)
+    rsw.run(args.date, args.dataPath, args.dataPathOutput, args.nproc)
+    return 0
+
+
+def runPlot(args):
+    resampledFiles = fl.getResampledFileList(args.date, args.dataPath)
+    if not any(os.path.exists(f) for f in resampledFiles):
+        print('no resampled files found ', args.date.strftime('%Y%m%d'))
+        return 0
+    tpp = importStage('tripex_pol_plots', args.profile_imports)
+    tpp.run(args.date, args.dataPath, args.dataPathOutput, args.emptyDataPath)
+    return 0
+
+
+def runRHI(args):
+    if not fl.getFileList(fl.rhiFilePattern, args.date, args.dataPath):
+        print('no files found ', args.date.strftime('%Y%m%d'))
+        return 0
+    rhi = importStage('tripex_pol_rhi_plots', args.profile_imports)
+    rhi.plotDay(args.date, args.dataPath, args.dataPathOutput)
+    return 0
+
+
+def runServe(args):
+    if not os.path.isdir(args.dataPath):
+        print('data path not found ', args.dataPath)
+        return 1
+    tls = importStage('tileServer', args.profile_imports)
+    tls.serve(args.dataPath, args.emptyDataPath, args.port, args.cache_dir)
+    return 0
+
+
+def parseDate(dateStr):
+    try:
+        return datetime.datetime.strptime(dateStr, '%Y%m%d')
+    except ValueError:
+        raise argparse.ArgumentTypeError('date has to be YYYYMMDD, got {0}'.format(dateStr))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='resampling and quicklooks of the X-, Ka- and W-Band radars')
+    parser.add_argument('--profile-imports', action='store_true',
+                        help='report the import time of the heavy libraries')
+    subparsers = parser.add_subparsers(dest='step', required=True)
+
+    resample = subparsers.add_parser('resample', help='resample the X- or Ka-Band data')
+    resample.add_argument('date', type=parseDate)
+    resample.add_argument('dataPath')
+    resample.add_argument('dataPathOutput')
+    resample.add_argument('band', choices=['X', 'Ka'])
+    resample.add_argument('--ref-band', choices=['Ka', 'W'], default=None,
+                          help='correct the time lag and range offset relative to this band')
+    resample.set_defaults(func=runResample)
+
+    wband = subparsers.add_parser('wband', help='resample the zenith W-Band scan data')
+    wband.add_argument('date', type=parseDate)
+    wband.add_argument('dataPath')
+    wband.add_argument('dataPathOutput')
+    wband.add_argument('--nproc', type=int, default=4)
+    wband.set_defaults(func=runWband)
+
+    plot = subparsers.add_parser('plot', help='plot the quicklooks of the resampled data')
+    plot.add_argument('date', type=parseDate)
+    plot.add_argument('dataPath')
+    plot.add_argument('dataPathOutput')
+    plot.add_argument('emptyDataPath')
+    plot.set_defaults(func=runPlot)
+
+    rhi = subparsers.add_parser('rhi', help='plot the RHI scans of a day')
+    rhi.add_argument('date', type=parseDate)
+    rhi.add_argument('dataPath')
+    rhi.add_argument('dataPathOutput')
+    rhi.set_defaults(func=runRHI)
+
+    serve = subparsers.add_parser('serve', help='serve quicklook tiles of the resampled data on localhost')
+    serve.add_argument('dataPath')
+    serve.add_argument('emptyDataPath')
+    serve.add_argument('--port', type=int, default=8000)
+    serve.add_argument('--cache-dir', default=None,
+                       help='directory of the on-disk tile cache (default: DATAPATH/tileCache)')
+    serve.set_defaults(func=runServe)
+
+    args = parser.parse_args(argv)
+    if args.step == 'resample' and args.ref_band == args.band:
+        # the new data would be compared with the previous file of the same band
+        resample.error('--ref-band has to be another band than {0}'.format(args.band))
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
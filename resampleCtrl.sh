@@ -7,6 +7,7 @@ pathPro=/project/meteo/work/L.Terzi/radar_quicklooks/create_quicklooks # this is
 
 #pathKaBand=
 pathXBand=/archive/meteo/external-obs/juelich/joyrad10/
+#pathWBand=
 
 pathOutput=/scratch/l/L.Terzi/test_resampling_ouptut/resampled/
 emptyDataPath=/scratch/l/L.Terzi/campaign_aux_data/tripex-pol/auxPlotData/noData2.nc
@@ -21,19 +22,31 @@ echo $current_date
 echo @@@@@@@@@@@@@@@@@@@@@@@
 #date
 
-echo Starting X-Band resampling
-python3 $pathPro/resampleXKaBand.py $current_date $pathXBand $pathOutput X
-
+# the reference bands of --ref-band are resampled first
 #echo Starting Ka-Band resampling
-#python3 $pathPro/resampleXKaBand.py  $current_date $pathXKa $pathOutput Ka
+#python3 $pathPro/quicklooks.py resample $current_date $pathXKa $pathOutput Ka
 
 #echo Starting wband_scan
-#python3 $pathPro/resampleWbandScan.py $argument:ZEN
+#python3 $pathPro/quicklooks.py wband $current_date $pathWBand $pathOutput
+
+echo Starting X-Band resampling
+python3 $pathPro/quicklooks.py resample $current_date $pathXBand $pathOutput X
+
+# with --ref-band the clock drift and range offset relative to it are corrected
+# (the reference band has to be resampled before)
+#python3 $pathPro/quicklooks.py resample $current_date $pathXBand $pathOutput X --ref-band Ka
+
+# estimate the Ze offsets of the last days (they are applied by the plot routine)
+#python3 $pathPro/calibrateOffsets.py $(date -d "$current_date -7 days" +%Y%m%d) $current_date $pathOutput $pathOutput 4
 
 echo Starting the plot routine
-python3 $pathPro/tripex_pol_plots.py $current_date $pathOutput $pathOutput $emptyDataPath
+python3 $pathPro/quicklooks.py plot $current_date $pathOutput $pathOutput $emptyDataPath
+
 
 
+# alternatively resample and plot in one go, without reading the resampled files back
+# (the last argument is the number of plotting processes)
+#python3 $pathPro/resamplePlotPipeline.py $current_date $pathXBand none none $pathOutput $emptyDataPath 4
 
 echo finished
 echo -----------------------
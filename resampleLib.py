@@ -10,18 +10,158 @@
 #---------------------------
 
 
-import pandas as pd
 import numpy as np
-import xarray as xr
-import netCDF4 as nc
-import glob
+import os
+import fileLib as fl
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 
 #----------------------------
-# Common functions used for processing X-, Ka-, W-Band radars
+# This block defines the range reference grid.
+# The reference grid is the same for all radars
 #
+beginRangeRef = 0 # starting height of the ref grid
+endRangeRef = 12000 # ending height of the ref grid
+rangeFreq = 36 # range resolution of the ref grid
+rangeTolerance = 18 # tolerance for detecting the closest neighbour
+
+rangeRef = np.arange(beginRangeRef, endRangeRef, rangeFreq)
+
+# time tolerance for detecting closest neighbour (seconds)
+timeTolerance = '2S'
+timeFreq = '4S'
+
+# netCDF chunks of the resampled files (moments and difference
+# products): one hour of the time grid and the whole range grid
+chunkTime = 900
+#----------------------------
+
+
+#----------------------------
+# Common functions used for processing X-, Ka-, W-Band radars.
+# pandas and xarray are imported by the functions which need them,
+# so that the grid, prefetch and index functions only cost numpy
+#
+def prefetchFiles(fileList, readFunc, queueDepth=2,
+                  maxMemory=2*1024**3):
+    """
+    Reads the files of a list on background threads while the
+    caller processes the previous ones (read-ahead)
+
+    Parameters
+    ----------
+    fileList: list of files from the same day
+    readFunc: function that reads one file into memory and
+        returns the data (e.g. a loaded xarray dataset)
+    queueDepth: number of files read ahead, this is also
+        the number of reading threads (default: 2)
+    maxMemory: no further file is read ahead as long as the
+        read ahead data exceed this size in bytes (default: 2 GiB).
+        Files still being read are counted with their size on
+        disk, so the limit is approximate for compressed files
+
+    Returns
+    -------
+    generator yielding (filePath, data, error) for each file in
+    the order of fileList. If reading failed data is None and
+    error is the raised exception.
+
+    """
+
+    fileIter = iter(fileList)
+    pending = deque()
+
+    def bufferedBytes():
+        nbytes = 0
+        for filePath, future in pending:
+            if not future.done():
+                # not read yet, estimated by the file size
+                nbytes += fileSize(filePath)
+            elif future.exception() is None:
+                nbytes += getattr(future.result(), 'nbytes', 0)
+        return nbytes
+
+    def fileSize(filePath):
+        try:
+            return os.path.getsize(filePath)
+        except OSError:
+            return 0
+
+    def fillQueue():
+        while len(pending) < queueDepth and bufferedBytes() < maxMemory:
+            try:
+                filePath = next(fileIter)
+            except StopIteration:
+                return
+            pending.append((filePath, executor.submit(readFunc, filePath)))
+
+    executor = ThreadPoolExecutor(max_workers=max(queueDepth, 1))
+    try:
+        fillQueue()
+        while pending:
+            filePath, future = pending.popleft()
+            error = future.exception()
+            data = future.result() if error is None else None
+            # start reading the next files before handing this one over,
+            # an empty buffer is always refilled with at least one file
+            fillQueue()
+            yield filePath, data, error
+            fillQueue()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def getEncoding(data):
+    """
+    Defines the netCDF encoding of the resampled files, so that
+    the moments and the difference products are stored with
+    the same compression and chunks
+
+    Parameters
+    ----------
+    data: xarray dataset to be saved
+
+    Returns
+    -------
+    encoding: dictionary of the encoding of each variable
+
+    """
+
+    encoding = {}
+    for var in data.data_vars:
+        encoding[var] = {'zlib': True}
+        if data[var].ndim > 0:
+            encoding[var]['chunksizes'] = tuple(max(min(chunkTime, n), 1) if dim == 'time' else max(n, 1)
+                                                for dim, n in zip(data[var].dims, data[var].shape))
+
+    return encoding
+
+
+def getPoolContext():
+    """
+    Start method of the process pools. The scripts write netCDF
+    files on background threads, a forked child could inherit
+    HDF5 in the middle of a write, so the children are started
+    fresh (forkserver, spawn where forkserver is not available)
+
+    Returns
+    -------
+    context: multiprocessing context for ProcessPoolExecutor
+
+    """
+
+    import multiprocessing
+
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+
+    return multiprocessing.get_context('spawn')
+
+
 def getVar(var, tempDataSet, fileList,
-           epoch='1970-01-01 00:00:00 UTC'):
+           epoch='1970-01-01 00:00:00 UTC',
+           queueDepth=2, maxMemory=2*1024**3):
     """
     Retrieves the desired radar variables from a list
     of radar files
@@ -35,6 +175,8 @@ def getVar(var, tempDataSet, fileList,
         to define the starting point. The W-Band radar
         uses 1970-01-01 00:00:00 UTC as starting reference time
         (default: 1970-01-01 00:00:00 UTC)
+    queueDepth: number of files read ahead (see prefetchFiles)
+    maxMemory: memory cap of the read-ahead buffer in bytes
 
     Returns
     -------
@@ -42,13 +184,21 @@ def getVar(var, tempDataSet, fileList,
 
     """
 
-    for filePath in fileList:
+    import xarray as xr
+
+    def readFile(filePath):
+        with fl.netcdfLock:
+            with xr.open_dataset(filePath) as tempDS:
+                tempDS.time.attrs['units']='seconds since 1970-01-01 {0}'.format(epoch)
+                tempDS = xr.decode_cf(tempDS)
+                return tempDS[var].load()
+
+    for filePath, tempDSVar, error in prefetchFiles(fileList, readFile,
+                                                   queueDepth, maxMemory):
 
         try:
-            tempDS = xr.open_dataset(filePath)
-            tempDS.time.attrs['units']='seconds since 1970-01-01 {0}'.format(epoch)
-            tempDS = xr.decode_cf(tempDS)
-            tempDSVar = tempDS[var]
+            if error is not None:
+                raise error
             tempDataSet = xr.merge([tempDataSet, tempDSVar])
 
         except:
@@ -154,6 +304,78 @@ def getResampledVar(var, xrDataset, timeIndexArray, rangeIndexArray):
     return resampledArr.T
 
 
+def getNearestIndex(refGrid, radarGrid, tolerance):
+    """
+    Vectorized version of calcRadarDeltaGrid and getNearestIndexM2.
+    Identifies for each element of the reference grid the index of
+    the closest element of the radar grid using a binary search,
+    without building the full distance matrix
+
+    Parameters
+    ----------
+    refGrid: reference grid (array[n])
+    radarGrid: radar grid (array[m], sorted in ascending order)
+    tolerance: tolerance distance for detecting
+        the closest neighbour (same units as the grids)
+
+    Returns
+    -------
+    gridIndex: array[n] of indexes of the radar grid, -1 where no
+        radar grid element fulfils the resampling tolerance
+
+    """
+
+    refGrid = np.asarray(refGrid)
+    radarGrid = np.asarray(radarGrid)
+    gridIndex = np.full(refGrid.shape, -1, dtype=np.int64)
+    if radarGrid.size == 0:
+        return gridIndex
+
+    right = np.clip(np.searchsorted(radarGrid, refGrid), 1, radarGrid.size-1)
+    left = right - 1
+    if radarGrid.size == 1:
+        right = left = np.zeros_like(right)
+    deltaLeft = np.abs(refGrid - radarGrid[left])
+    deltaRight = np.abs(radarGrid[right] - refGrid)
+    nearest = np.where(deltaRight < deltaLeft, right, left)
+    deltaMin = np.minimum(deltaLeft, deltaRight)
+    valid = deltaMin <= tolerance
+    gridIndex[valid] = nearest[valid]
+
+    return gridIndex
+
+
+def getResampledVarIndexed(values, timeIndexArray, rangeIndexArray):
+    """
+    Vectorized version of getResampledVar. It resamples a given
+    radar variable in one pass using the time and range index
+    calculated by getNearestIndex
+
+    Parameters
+    ----------
+    values: radar variable (array[time, range])
+    timeIndexArray: time resampling index (output from getNearestIndex)
+    rangeIndexArray: range resampling index (output from getNearestIndex)
+
+    Returns
+    -------
+    resampledArr: time/range resampled numpy array, nan where
+        no radar data fulfils the tolerance
+
+    """
+
+    values = np.asarray(values, dtype=np.float64)
+    validTime = timeIndexArray >= 0
+    validRange = rangeIndexArray >= 0
+    resampledArr = np.full((timeIndexArray.shape[0], rangeIndexArray.shape[0]), np.nan)
+    if values.size == 0:
+        return resampledArr
+    resampledArr[np.ix_(validTime, validRange)] = values[np.ix_(timeIndexArray[validTime],
+                                                                rangeIndexArray[validRange])]
+
+    return resampledArr
+
+
 def getTimeRef(date, dateFreq='2s'):
     """
     Genetates the time reference grid used for
@@ -170,6 +392,8 @@ def getTimeRef(date, dateFreq='2s'):
 
     """
 
+    import pandas as pd
+
     start = pd.datetime(date.year,
                         date.month,
                         date.day,
@@ -186,6 +410,104 @@ def getTimeRef(date, dateFreq='2s'):
 #----------------------------
 
 
+#----------------------------
+# Quality control applied to all radars on the reference grid
+#
+# bits of the quality control flag, a gate is good if the flag is 0
+qcFlags = {'no_signal':1, 'noise_floor':2, 'speckle':4, 'clutter':8}
+
+# default settings of the quality control, they can be changed per radar
+# noiseFloor: minimum Ze at noiseRangeRef [dB], it increases with 20*log10(range)
+# minNeighbours: minimum number of valid gates of the 8 neighbours (speckle)
+# clutterHeight: gates below this height are removed [m]
+qcDefaults = {'noiseFloor':-60, 'noiseRangeRef':1000,
+              'minNeighbours':3, 'clutterHeight':300}
+
+
+def calcQCMask(ze, rangeGrid, qcOptions=None):
+    """
+    Calculates the quality control flag of one radar on the
+    reference grid. All filters work on the whole day at once
+
+    Parameters
+    ----------
+    ze: reflectivity in dB (array[time, range])
+    rangeGrid: range reference grid (array[range])
+    qcOptions: dictionary overriding entries of qcDefaults
+
+    Returns
+    -------
+    qcFlag: bitmask (uint8 array[time, range]) with the bits of qcFlags
+
+    """
+
+    options = dict(qcDefaults, **(qcOptions or {}))
+    rangeGrid = np.asarray(rangeGrid, dtype=np.float64)
+    qcFlag = np.zeros(ze.shape, dtype=np.uint8)
+
+    signal = np.isfinite(ze)
+    qcFlag[~signal] |= qcFlags['no_signal']
+
+    # the sensitivity decreases with the square of the range
+    with np.errstate(divide='ignore', invalid='ignore'):
+        noiseFloor = options['noiseFloor'] + 20*np.log10(np.maximum(rangeGrid, 1)/options['noiseRangeRef'])
+        belowNoise = signal & (ze < noiseFloor[np.newaxis, :])
+    qcFlag[belowNoise] |= qcFlags['noise_floor']
+    signal &= ~belowNoise
+
+    # number of valid neighbours (3x3 convolution as sum of shifted arrays)
+    padded = np.pad(signal, 1).astype(np.uint8)
+    neighbours = np.zeros(ze.shape, dtype=np.uint8)
+    for dt in range(3):
+        for dr in range(3):
+            if dt == 1 and dr == 1:
+                continue
+            neighbours += padded[dt:dt+ze.shape[0], dr:dr+ze.shape[1]]
+    qcFlag[signal & (neighbours < options['minNeighbours'])] |= qcFlags['speckle']
+
+    qcFlag[:, rangeGrid < options['clutterHeight']] |= qcFlags['clutter']
+
+    return qcFlag
+
+
+def applyQCMask(data, zeName, varList, qcOptions=None):
+    """
+    Calculates the quality control flag of a resampled dataset and
+    sets all flagged gates of the moments to nan in place
+
+    Parameters
+    ----------
+    data: resampled xarray dataset (time, range), Ze in dB
+    zeName: name of the reflectivity variable
+    varList: list of the moments to be masked
+    qcOptions: dictionary overriding entries of qcDefaults
+
+    Returns
+    -------
+    data: the dataset with the masked moments and the variable qc_flag
+
+    """
+
+    data = data.load()
+    qcFlag = calcQCMask(data[zeName].transpose('time', 'range').values,
+                        data.range.values, qcOptions)
+    mask = qcFlag != 0
+    for var in varList:
+        values = data[var].transpose('time', 'range').values
+        if not np.issubdtype(values.dtype, np.floating):
+            values = values.astype(np.float64)
+            data[var] = (('time', 'range'), values, data[var].attrs)
+        values[mask] = np.nan
+
+    data['qc_flag'] = (('time', 'range'), qcFlag)
+    data['qc_flag'].attrs = {'long_name':'quality control flag, 0: good',
+                             'flag_masks':np.array(list(qcFlags.values()), dtype=np.uint8),
+                             'flag_meanings':' '.join(qcFlags.keys())}
+
+    return data
+#----------------------------
+
+
 #----------------------------
 # Functions used only for processing Ka-Band radar
 #
@@ -205,6 +527,9 @@ def dropTimeDuplicates(xrDS1, xrDS2):
 
     """
 
+    import pandas as pd
+    import xarray as xr
+
     pdDF1 = pd.DataFrame(xrDS1.sk.values, index=xrDS1.time.values)
     pdDF1['times'] = xrDS1.time.values
 
@@ -253,6 +578,9 @@ def getDataWband(variablesToGet, datasetNC, epoch):
 
     """
 
+    import pandas as pd
+    import xarray as xr
+
     epoch = pd.to_datetime(epoch)
 
     for var in variablesToGet.keys():
@@ -273,7 +601,8 @@ def getDataWband(variablesToGet, datasetNC, epoch):
 
 
 def getVarWband(variablesToGet, tempDataSet,
-                fileList, epoch='2001-01-01 00:00:00'):
+                fileList, epoch='2001-01-01 00:00:00',
+                queueDepth=2, maxMemory=2*1024**3):
     """
     Retrieves the desired radar variables from a list
     of radar files
@@ -287,6 +616,8 @@ def getVarWband(variablesToGet, tempDataSet,
         to define the starting point. The W-Band radar
         uses 2001-01-01 00:00:00 as starting reference time
         (default: 2001-01-01 00:00:00)
+    queueDepth: number of files read ahead (see prefetchFiles)
+    maxMemory: memory cap of the read-ahead buffer in bytes
 
     Returns
     -------
@@ -294,11 +625,25 @@ def getVarWband(variablesToGet, tempDataSet,
 
     """
 
-    for filePath in fileList:
+    # netCDF4 is only needed for the W-Band files
+    import netCDF4 as nc
+    import xarray as xr
+    # netCDF-C/HDF5 are not thread-safe, the reading threads hold the
+    # netCDF lock of the scripts and the one of xarray's own netCDF access
+    from xarray.backends.locks import HDF5_LOCK
+
+    def readFile(filePath):
+        with fl.netcdfLock, HDF5_LOCK:
+            with nc.Dataset(filePath) as joyrad94NC:
+                # getDataWband fills the dictionary, so every thread needs its own
+                return getDataWband(dict(variablesToGet), joyrad94NC, epoch)
+
+    for filePath, tempDSVar, error in prefetchFiles(fileList, readFile,
+                                                   queueDepth, maxMemory):
 
         try:
-            joyrad94NC = nc.Dataset(filePath)
-            tempDSVar = getDataWband(variablesToGet, joyrad94NC, epoch)
+            if error is not None:
+                raise error
             tempDataSet = xr.merge([tempDataSet, tempDSVar])
 
         except:
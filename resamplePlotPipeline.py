@@ -0,0 +1,333 @@
+#----------------------------
+# This script resamples the X-, Ka- and W-Band data and plots the
+# quicklooks in one process. The resampled datasets are handed
+# directly to the plotting functions, the netCDF files are
+# written in the background while the plots are created.
+# OPTIMIce Emmy-Noether Group
+# Institute for Geophysics and Meteorology
+# University of Cologne
+#----------------------------
+
+
+from sys import argv
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory, resource_tracker
+import threading
+import pandas as pd
+import numpy as np
+import xarray as xr
+import fileLib as fl
+import resampleLib as rspl
+import resampleXKaBand as rsx
+import resampleWbandScan as rsw
+import tripex_pol_plots as tpp
+import statisticsLib as stl
+import differenceLib as dfl
+
+'''
+input:
+date: date that you want to have processed
+dataPathX: path where the X-band data is stored
+dataPathKa: path where the Ka-band data is stored
+dataPathW: path where the W-band scan data is stored
+dataPathOutput: path where to put the resampled netcdf files and the plots
+emptyDataPath: path to where there is a nc file with empty data in it
+nProc: optional, number of plotting processes (default 1: plot in this process)
+'''
+
+
+def shareVariables(dataList, varList):
+	"""
+	Copies the given variables of the datasets into shared memory
+	blocks so that they can be handed to a process pool without
+	pickling the arrays
+
+	Parameters
+	----------
+	dataList: dictionary of xarray datasets (key: radar name)
+	varList: dictionary of the variables to be shared (key: radar name)
+
+	Returns
+	-------
+	sharedInfo: dictionary with the shared memory name, shape, dtype
+		and coordinates of each variable (same keys as dataList)
+	shmList: list of the created shared memory blocks, they have
+		to be unlinked by the caller
+	"""
+	sharedInfo = {}
+	shmList = []
+	for rad in varList.keys():
+		sharedInfo[rad] = {}
+		for var in varList[rad]:
+			values = np.ascontiguousarray(dataList[rad][var].values)
+			shm = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+			sharedArr = np.ndarray(values.shape, dtype=values.dtype, buffer=shm.buf)
+			sharedArr[:] = values
+			shmList.append(shm)
+			sharedInfo[rad][var] = {'name':shm.name, 'shape':values.shape,
+			                        'dtype':values.dtype.str,
+			                        'dims':dataList[rad][var].dims,
+			                        'coords':{dim:dataList[rad][var][dim].values for dim in dataList[rad][var].dims},
+			                        'attrs':dataList[rad][var].attrs}
+	return sharedInfo, shmList
+
+
+def attachVariable(info):
+	"""
+	Attaches to a shared memory block created by shareVariables and
+	wraps it into an xarray dataarray without copying
+
+	Parameters
+	----------
+	info: one entry of the sharedInfo dictionary
+
+	Returns
+	-------
+	dataArr: xarray dataarray backed by the shared memory
+	shm: the attached shared memory block, it has to be closed after use
+	"""
+	try:
+		# the parent process owns the block, it is not tracked by the worker
+		shm = shared_memory.SharedMemory(name=info['name'], track=False)
+	except TypeError:
+		# python < 3.13: attaching registers the block at the resource tracker.
+		# Forked (and usually spawned) workers share the tracker of the parent,
+		# there the registration is a no-op and must not be removed, otherwise
+		# the parent's unlink fails. Only a worker with its own tracker would
+		# unlink the block at exit, so only then it is unregistered
+		ownTracker = getattr(resource_tracker._resource_tracker, '_fd', None) is None
+		shm = shared_memory.SharedMemory(name=info['name'])
+		if ownTracker:
+			resource_tracker.unregister(shm._name, 'shared_memory')
+	values = np.ndarray(info['shape'], dtype=np.dtype(info['dtype']), buffer=shm.buf)
+	dataArr = xr.DataArray(values, dims=info['dims'], coords=info['coords'], attrs=info['attrs'])
+	return dataArr, shm
+
+
+def plotShared(plotFunc, var, strDate, sharedInfo, sharedKeys, dataPathOutput):
+	"""
+	Process pool worker: attaches the shared variables and calls
+	the plotting function
+
+	Parameters
+	----------
+	plotFunc: tpp.plotMoment or tpp.plotDifference
+	var: name of the moment
+	strDate: plotting day (str, %Y%m%d)
+	sharedInfo: output from shareVariables
+	sharedKeys: list of (radar name, variable) of the dataarrays
+		handed to plotFunc
+	dataPathOutput: path where to put the plot
+	"""
+	attached = [attachVariable(sharedInfo[rad][name]) for rad, name in sharedKeys]
+	dataArrs = [dataArr for dataArr, shm in attached]
+	shmList = [shm for dataArr, shm in attached]
+	del attached
+	try:
+		plotFunc(var, strDate, *dataArrs, dataPathOutput)
+	finally:
+		# all arrays wrapping the shared buffers have to be released before closing
+		del dataArrs
+		for shm in shmList:
+			try:
+				shm.close()
+			except BufferError:
+				# still referenced (e.g. by the traceback of a failed plot),
+				# the mapping is released when the worker exits
+				pass
+	return var
+
+
+def loadData(data):
+	"""
+	Loads a lazily opened dataset into memory and closes its file.
+	The band files may be written on the writer threads at the same
+	time, so the netCDF lock is held
+
+	Parameters
+	----------
+	data: xarray dataset opened from a netCDF file
+
+	Returns
+	-------
+	data: the dataset in memory
+	"""
+	with fl.netcdfLock:
+		data = data.load()
+		data.close()
+	return data
+
+
+def closeData(data):
+	"""
+	Closes the file of a dataset, holding the netCDF lock
+	"""
+	with fl.netcdfLock:
+		data.close()
+	return None
+
+
+def writeDiffData(diffData, writers, date, dataPathOutput, offsets):
+	"""
+	Saves the difference products once the band files are written,
+	so that they are marked as calculated from these files
+
+	Parameters
+	----------
+	diffData: output from dfl.calcDiffProducts
+	writers: threads writing the band files
+	date: date of the resampled data (pandas Timestamp)
+	dataPathOutput: path where to put the difference product file
+	offsets: dictionary of the Ze offsets
+	"""
+	for writer in writers:
+		writer.join()
+	fileList = tpp.getFileNames(date, dataPathOutput)
+	# days without any band file are not stored
+	if dfl.hasSourceFiles(fileList):
+		signature = dfl.getSourceSignature(fileList, offsets)
+		dfl.writeDiffProducts(diffData, dfl.getDiffFileName(dataPathOutput, date), signature)
+	return None
+
+
+def writeStatsProducts(dataList, resampled, dataPathOutput, date):
+	"""
+	Calculates and saves the CFADs and mean profiles of the
+	resampled bands and of the DWRs between them
+
+	Parameters
+	----------
+	dataList: dictionary of xarray datasets (key: radar name)
+	resampled: dictionary of the resampled radars and their band name
+	dataPathOutput: path where to put the statistics files
+	date: date of the resampled data (pandas Timestamp)
+	"""
+	for rad in resampled.keys():
+		stats = stl.calcStats(dataList[rad], {var:stl.cfadBins[var] for var in rsx.statVars})
+		stl.writeStats(stats, rsx.rangeRef, stl.getStatsFileName(dataPathOutput, date, resampled[rad]+'-band'))
+
+	for rad1, rad2 in [('rad10', 'rad35'), ('rad35', 'rad94')]:
+		if rad1 in resampled and rad2 in resampled:
+			name = 'DWR_'+resampled[rad1]+resampled[rad2]
+			dataDWR = xr.Dataset({'DWR':dataList[rad1]['Zg'] - dataList[rad2]['Zg']})
+			stats = stl.calcStats(dataDWR, {'DWR':stl.cfadBins['DWR']})
+			stl.writeStats(stats, rsx.rangeRef, stl.getStatsFileName(dataPathOutput, date, name))
+	return None
+
+
+def resampleAndPlot(date, dataPathX, dataPathKa, dataPathW, dataPathOutput, emptyDataPath, nProc=1):
+	"""
+	Resamples the X-, Ka- and W-Band data of one day and plots the
+	quicklooks without reading the resampled files back from disk
+
+	Parameters
+	----------
+	date: date that you want to have processed (pandas Timestamp)
+	dataPathX: path where the X-band data is stored
+	dataPathKa: path where the Ka-band data is stored
+	dataPathW: path where the W-band scan data is stored
+	dataPathOutput: path where to put the resampled netcdf files and the plots
+	emptyDataPath: path to where there is a nc file with empty data in it
+	nProc: number of plotting processes, with nProc > 1 the data are
+		handed to the processes through shared memory (default 1)
+	"""
+	# reading the files from disk first, only needed for the bands
+	# which are not resampled here or have no data
+	data10, data35, data94 = tpp.openData(date, dataPathOutput, emptyDataPath)
+	dataList = {'rad10':data10, 'rad35':data35, 'rad94':data94}
+
+	writers = []
+	resampled = {}
+	for rad, Band, dataPath in [('rad10', 'X', dataPathX), ('rad35', 'Ka', dataPathKa)]:
+		if dataPath is None:
+			continue
+		# the input is read under the netCDF lock, the data are in memory afterwards
+		data = rsx.resampleData(date, dataPath, Band)
+		if data is None:
+			continue
+		closeData(dataList[rad])
+		dataList[rad] = data
+		resampled[rad] = Band
+		writer = threading.Thread(target=rsx.writeData, args=(data, dataPathOutput, date, Band))
+		writer.start()
+		writers.append(writer)
+
+	if dataPathW is not None:
+		data = rsw.resampleData(date, dataPathW, max(nProc, 1))
+		if data is not None:
+			closeData(dataList['rad94'])
+			dataList['rad94'] = data.rename(tpp.renameWband)
+			resampled['rad94'] = 'W'
+			writer = threading.Thread(target=rsw.writeData, args=(data, dataPathOutput, date))
+			writer.start()
+			writers.append(writer)
+
+	# the bands which were not resampled are read from disk now, the writer
+	# threads are running, so no lazy read may happen later on
+	for rad in dataList.keys():
+		if rad not in resampled:
+			dataList[rad] = loadData(dataList[rad])
+
+	# CFADs and mean profiles as small side product
+	writer = threading.Thread(target=writeStatsProducts, args=(dict(dataList), resampled, dataPathOutput, date))
+	writer.start()
+	writers.append(writer)
+
+	# Ze offset correction, the offsets are estimated with calibrateOffsets.py
+	offsets = tpp.getOffsets(date, dataPathOutput)
+	# the difference products are calculated from the uncorrected data and
+	# written in the background after the band files
+	diffData = dfl.calcDiffProducts(dataList, offsets)
+	writer = threading.Thread(target=writeDiffData, args=(diffData, list(writers), date, dataPathOutput, offsets))
+	writer.start()
+	writers.append(writer)
+	dataList['rad10'], dataList['rad35'], dataList['rad94'] = tpp.applyOffsets(dataList['rad10'], dataList['rad35'],
+	                                                                           dataList['rad94'], offsets)
+
+	strDate = date.strftime('%Y%m%d')
+	if nProc > 1:
+		dataList['diff'] = diffData
+		varList = {rad:list(tpp.variables.keys()) for rad in ['rad10', 'rad35', 'rad94']}
+		varList['diff'] = list(diffData.data_vars)
+		sharedInfo, shmList = shareVariables(dataList, varList)
+		try:
+			# the plotting processes are started fresh, not forked from this
+			# process while the writer threads may be inside HDF5
+			with ProcessPoolExecutor(max_workers=nProc, mp_context=rspl.getPoolContext()) as executor:
+				futures = [executor.submit(plotShared, tpp.plotMoment, var, strDate, sharedInfo,
+				                           [('rad10', var), ('rad35', var), ('rad94', var)], dataPathOutput)
+				           for var in tpp.variables.keys()]
+				futures += [executor.submit(plotShared, tpp.plotDifference, var, strDate, sharedInfo,
+				                            [('diff', tpp.diffVariables[var]['name']+'_XKa'),
+				                             ('diff', tpp.diffVariables[var]['name']+'_KaW')], dataPathOutput)
+				            for var in tpp.diffVariables.keys()]
+				for future in futures:
+					future.result()
+		finally:
+			for shm in shmList:
+				shm.close()
+				shm.unlink()
+	else:
+		tpp.plotQuicklooks(date, dataList['rad10'], dataList['rad35'], dataList['rad94'], diffData, dataPathOutput)
+
+	for writer in writers:
+		writer.join()
+	for data in dataList.values():
+		closeData(data)
+	print('done with resampling and plotting')
+
+	return None
+
+
+if __name__ == '__main__':
+	scriptname, date, dataPathX, dataPathKa, dataPathW, dataPathOutput, emptyDataPath = argv[:7]
+	nProc = int(argv[7]) if len(argv) > 7 else 1
+	print(date)
+	date = pd.to_datetime(date)
+	# use "none" as path for a band that should not be resampled
+	dataPathX = None if dataPathX.lower() == 'none' else dataPathX
+	dataPathKa = None if dataPathKa.lower() == 'none' else dataPathKa
+	dataPathW = None if dataPathW.lower() == 'none' else dataPathW
+
+	resampleAndPlot(date, dataPathX, dataPathKa, dataPathW, dataPathOutput, emptyDataPath, nProc)
+
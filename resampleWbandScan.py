@@ -0,0 +1,217 @@
+#----------------------------
+# This script is used for resampling the zenith (ZEN) measurements
+# of the scanning W-Band radar onto the common grid
+# OPTIMIce Emmy-Noether Group
+# Institute for Geophysics and Meteorology
+# University of Cologne
+#----------------------------
+
+
+import fileLib as fl
+import resampleLib as rspl
+import statisticsLib as stl
+from sys import argv
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import numpy as np
+import xarray as xr
+import netCDF4 as nc
+import os
+
+'''
+input:
+date: date that you want to have processed
+dataPath: path where the W-band scan data is stored
+dataPathOutput: path where to put the resampled netcdf file
+nProc: optional, number of processes used for reading and resampling the files (default 4)
+'''
+
+# the range and time reference grid is the same for all radars
+rangeRef = rspl.rangeRef
+rangeTolerance = rspl.rangeTolerance
+timeTolerance = rspl.timeTolerance
+timeFreq = rspl.timeFreq
+
+# the W-Band is the height reference, so no range offset
+rangeOffset = 0
+
+# the radar software uses 2001-01-01 00:00:00 as starting reference time
+epoch = '2001-01-01 00:00:00'
+
+# zenith measurements are selected by the elevation angle
+scanType = 'ZEN'
+zenithElevation = 90
+elevationTolerance = 0.5
+
+# names of the variables in the output file and in the radar files,
+# the output names are the ones expected by tripex_pol_plots.py
+variablesToGet = {'Ze':'ze', 'MDV':'vm', 'WIDTH':'sw', 'sLDR':'sldr', 'SK':'sk'}
+timeName = 'time'
+rangeName = 'range'
+elevationName = 'elv'
+
+# variables that are converted to log units
+convert = ['Ze', 'sLDR']
+units = {'Ze':'dB', 'MDV':'m/s', 'WIDTH':'m/s', 'sLDR':'dB', 'SK':''}
+
+# quality control settings (see resampleLib.qcDefaults)
+qcOptions = {'noiseFloor':-60}
+
+# variables of which the CFADs and mean profiles are stored,
+# they are stored with the names of the X- and Ka-Band
+statVars = {'Ze':'Zg', 'MDV':'VELg'}
+
+
+def resampleFile(filePath, timeRef):
+	"""
+	Reads one W-Band scan file, selects the zenith measurements and
+	resamples them onto the reference grid
+
+	Parameters
+	----------
+	filePath: path of the radar file
+	timeRef: time reference grid of the day (DatetimeIndex)
+
+	Returns
+	-------
+	timePos: positions in timeRef that are covered by this file
+	resampled: dictionary of the resampled variables (array[len(timePos), len(rangeRef)])
+	"""
+	with nc.Dataset(filePath) as dataNC:
+		times = pd.to_datetime(epoch) + pd.to_timedelta(np.asarray(dataNC[timeName][:]), unit='s')
+		ranges = np.asarray(dataNC[rangeName][:]) + rangeOffset
+		elevation = np.asarray(dataNC[elevationName][:])
+		zenith = np.abs(elevation - zenithElevation) <= elevationTolerance
+		if not np.any(zenith):
+			return np.array([], dtype=np.int64), {}
+		values = {var:np.ma.filled(np.ma.asarray(dataNC[variablesToGet[var]][:], dtype=np.float64)[zenith], np.nan)
+		          for var in variablesToGet.keys() if variablesToGet[var] in dataNC.variables}
+
+	# sometimes we have duplicates in time
+	times, indexTime = np.unique(times.values[zenith], return_index=True)
+
+	timeIndex = rspl.getNearestIndex(timeRef.values.astype(np.int64), times.astype(np.int64),
+	                                 pd.Timedelta(timeTolerance).value)
+	rangeIndex = rspl.getNearestIndex(rangeRef, ranges, rangeTolerance)
+	timePos = np.nonzero(timeIndex >= 0)[0]
+
+	resampled = {}
+	for var in values.keys():
+		resampled[var] = rspl.getResampledVarIndexed(values[var][indexTime], timeIndex[timePos], rangeIndex)
+
+	return timePos, resampled
+
+
+def resampleData(date, dataPath, nProc=4):
+	"""
+	Reads all W-Band scan files of one day and resamples the
+	zenith measurements onto the common reference grid
+
+	Parameters
+	----------
+	date: date that you want to have processed (pandas Timestamp)
+	dataPath: path where the W-band scan data is stored
+	nProc: number of processes used for reading and resampling the files
+
+	Returns
+	-------
+	data: resampled xarray dataset, None if no files were found
+	"""
+	# getting the time reference grid
+	timeRef = pd.date_range(date, date+pd.offsets.Day(1)-pd.offsets.Second(1), freq=timeFreq)
+	# retrieving a list of files from the same day
+	dataFileList = fl.getFileList(fl.wbandFilePattern, date, dataPath)
+	if not dataFileList:
+		print('no files found ', date.strftime('%Y%m%d'))
+		return None
+
+	resampled = {var:np.full((len(timeRef), len(rangeRef)), np.nan) for var in variablesToGet.keys()}
+	with ProcessPoolExecutor(max_workers=nProc, mp_context=rspl.getPoolContext()) as executor:
+		futures = {f:executor.submit(resampleFile, f, timeRef) for f in dataFileList}
+		# the files are sorted, so later files overwrite the overlapping times of earlier ones
+		for f in dataFileList:
+			try:
+				timePos, resampledFile = futures[f].result()
+			except:
+				print('cannot open ',f)
+				continue
+			for var in resampledFile.keys():
+				resampled[var][timePos] = resampledFile[var]
+
+	data = xr.Dataset({var:(('time','range'), resampled[var]) for var in variablesToGet.keys()},
+	                  coords={'time':timeRef, 'range':rangeRef})
+	for var in convert:
+		with np.errstate(divide='ignore', invalid='ignore'):
+			data[var].values = 10*np.log10(data[var].values)
+	for var in variablesToGet.keys():
+		data[var].attrs['units'] = units[var]
+
+	# quality control: one mask for all moments, applied in place
+	# and stored as bitmask (qc_flag)
+	data = rspl.applyQCMask(data, 'Ze', list(variablesToGet.keys()), qcOptions)
+
+	return data
+
+
+def writeData(data, dataPathOutput, date):
+	"""
+	Saves the resampled data into a zlib compressed netCDF file
+
+	Parameters
+	----------
+	data: resampled xarray dataset (output from resampleData)
+	dataPathOutput: path where to put the resampled netcdf file
+	date: date of the resampled data (pandas Timestamp)
+
+	Returns
+	-------
+	outPutFileName: path of the written netcdf file
+	"""
+	# defining the final output path + name
+	outPutFileName = fl.getResampledFileName('W', date, dataPathOutput, scan=scanType)
+
+	print(outPutFileName)
+	# same compression and chunks for all resampled files
+	encoding = rspl.getEncoding(data)
+	# the file may be written on a background thread (see resamplePlotPipeline.py)
+	with fl.netcdfLock:
+		# if we already have the file, sometimes it won't overwrite it, so just remove the already existing one
+		if os.path.exists(outPutFileName):
+			os.remove(outPutFileName)
+		data.to_netcdf(outPutFileName,encoding=encoding)
+
+	return outPutFileName
+
+
+def run(date, dataPath, dataPathOutput, nProc=4):
+	"""
+	Resamples one day of zenith W-Band scan data and saves the
+	resampled data and their statistics
+
+	Parameters
+	----------
+	date: date that you want to have processed
+	dataPath: path where the W-band scan data is stored
+	dataPathOutput: path where to put the resampled netcdf file
+	nProc: number of processes used for reading and resampling the files
+	"""
+	date = pd.to_datetime(date)
+	data = resampleData(date, dataPath, nProc)
+	if data is not None:
+		writeData(data, dataPathOutput, date)
+		# CFADs and mean profiles as small side product
+		stats = stl.calcStats(data[list(statVars.keys())].rename(statVars),
+		                      {var:stl.cfadBins[var] for var in statVars.values()})
+		stl.writeStats(stats, rangeRef, stl.getStatsFileName(dataPathOutput, date, 'W-band'))
+		data.close()
+		print('done with resampling')
+	return None
+
+
+if __name__ == '__main__':
+	scriptname, date, dataPath, dataPathOutput = argv[:4]
+	nProc = int(argv[4]) if len(argv) > 4 else 4
+	print(date)
+
+	run(date, dataPath, dataPathOutput, nProc)
+
@@ -1,85 +1,120 @@
 #----------------------------
 # This script is used for resampling the data from X and Ka-Band from METEK
-# Author: Jose Dias Neto 
+# Author: Jose Dias Neto
 # OPTIMIce Emmy-Noether Group
 # Institute for Geophysics and Meteorology
 # University of Cologne
 #----------------------------
 
 
+import fileLib as fl
 import resampleLib as rspl
+import statisticsLib as stl
+import lagLib as lag
 from sys import argv
 import pandas as pd
 import numpy as np
 import xarray as xr
-import glob
 import os
 
-scriptname, date,dataPath,dataPathOutput,Band = argv #, date,dataPath,dataPathOutput,Band
-print(date)
-date = pd.to_datetime(date)
-#print(date)
-#quit()
 '''
-input: 
+input:
 date: date that you want to have processed
 dataPath: path where the X-band data is stored
 dataPathOutput: path where to put the resampled netcdf file
 Band: either X or Ka
+refBand: optional, already resampled band (Ka or W) used to estimate and
+	correct the time lag and range offset (see lagLib)
 '''
 
-#----------------------------
-# This block defines the range reference grid.
-# The reference grid is the same for all radars
-#
-beginRangeRef = 0 # starting height of the ref grid
-endRangeRef = 12000 # ending height of the ref grid
-rangeFreq = 36 # range resolution of the ref grid
-rangeTolerance = 18 # tolerance for detecting the closest neighbour
-
-rangeRef = np.arange(beginRangeRef, endRangeRef, rangeFreq)
-#
-#----------------------------
+# the range and time reference grid is the same for all radars
+rangeRef = rspl.rangeRef
+rangeTolerance = rspl.rangeTolerance
+timeTolerance = rspl.timeTolerance
+timeFreq = rspl.timeFreq
+
+# read-ahead of the per-file fallback: number of files read in the
+# background and memory cap of the read-ahead buffer (bytes)
+prefetchDepth = 4
+prefetchMemory = 2*1024**3
+
+# the time lag and range offset estimated from the reference band are
+# only corrected if they are larger than these values
+minTimeLag = 1 # [s]
+minRangeLag = 1 # [m]
+
+# quality control settings of each band (see resampleLib.qcDefaults)
+qcOptions = {'X':{'noiseFloor':-50}, 'Ka':{'noiseFloor':-60}}
+
+# variables of which the CFADs and mean profiles are stored
+statVars = ['Zg','VELg']
+
+
+def resampleData(date, dataPath, Band, queueDepth=prefetchDepth, maxMemory=prefetchMemory,
+				 timeLag=0, rangeLag=0):
+	"""
+	Reads all X- or Ka-Band files of one day and resamples
+	them onto the common reference grid
 
-# time tolerance for detecting closest neighbour (seconds)
-timeTolerance = '2S'
-timeFreq = '4S'
-# getting the time reference grid
-
-timeRef = timeRef = pd.date_range(date, date+pd.offsets.Day(1)-pd.offsets.Second(1), freq=timeFreq)
-# Height offset, it is set to 2.2 here because the height
-# of W-Band is the reference
-if Band == 'Ka':
-	rangeOffset = 2.2
-else:
-	rangeOffset = 0.32
-# defining the input file name
-dataFilePath = '{path}/{year}/{month}/{day}/{date}_??????.znc'.format(path=dataPath,
-																			year = date.strftime('%Y'),
-																			month = date.strftime('%m'),
-																			day = date.strftime('%d'), 
-																			date = date.strftime('%Y%m%d'))
-
-# retrieving a list of files from the same day
-dataFileList = sorted(glob.glob(dataFilePath))
-if Band == 'Ka':
-	var2proc = ['Zg','RMSg','VELg','LDRg','SKWg']
-else:
-	var2proc = ['Zg','RMSg','VELg','SKWg']
-if dataFileList:
+	Parameters
+	----------
+	date: date that you want to have processed (pandas Timestamp)
+	dataPath: path where the radar data is stored
+	Band: either X or Ka
+	queueDepth: number of files read ahead if the files have to be opened one by one
+	maxMemory: memory cap of the read-ahead buffer in bytes
+	timeLag: clock correction added to the time of the radar [s], either
+		constant or the per-window lags of lagLib.getTimeLags, which are
+		interpolated onto the radar times
+	rangeLag: range correction added to the range offset [m]
+
+	Returns
+	-------
+	data: resampled xarray dataset, None if no files were found
+	"""
+	# getting the time reference grid
+	timeRef = pd.date_range(date, date+pd.offsets.Day(1)-pd.offsets.Second(1), freq=timeFreq)
+	# Height offset, it is set to 2.2 here because the height
+	# of W-Band is the reference
+	if Band == 'Ka':
+		rangeOffset = 2.2
+	else:
+		rangeOffset = 0.32
+	# retrieving a list of files from the same day
+	dataFileList = fl.getFileList(fl.xkaFilePattern, date, dataPath)
+	if not dataFileList:
+		print('no files found ', date.strftime('%Y%m%d'))
+		return None
+
+	if Band == 'Ka':
+		var2proc = ['Zg','RMSg','VELg','LDRg','SKWg']
+	else:
+		var2proc = ['Zg','RMSg','VELg','SKWg']
 	# now read in all available files
 	try: # we have to do try here, because sometimes files are broken and then it doesn't work to use open_mfdataset
-		data = xr.open_mfdataset(dataFileList)
-		data = data[var2proc]
-	except: 
+		# read at once (like the fallback), so that no lazy read of the files happens
+		# outside the netCDF lock while other threads write files
+		with fl.netcdfLock:
+			with xr.open_mfdataset(dataFileList) as dataAll:
+				data = dataAll[var2proc].load()
+	except:
+		def readFile(f):
+			# netCDF-C/HDF5 are not thread-safe, the reading threads take turns
+			with fl.netcdfLock:
+				with xr.open_dataset(f) as dataSmall:
+					return dataSmall[var2proc].load()
+
 		data = xr.Dataset()
-		for f in dataFileList: # if one file is broken, loop through all the files and open individually, except for the one which is not working
-			try: 
-				dataSmall = xr.open_dataset(f)
-				data = xr.merge([data,dataSmall[var2proc]])
+		# if one file is broken, loop through all the files and open individually, except for the one which is not working
+		# the next files are read in the background while the current one is merged
+		for f, dataSmall, error in rspl.prefetchFiles(dataFileList, readFile, queueDepth, maxMemory):
+			try:
+				if error is not None:
+					raise error
+				data = xr.merge([data,dataSmall])
 			except:
 				print('cannot open ',f)
-	
+
 	#- sometimes we have duplicates in time
 	_, index_time = np.unique(data['time'], return_index=True)
 	data = data.isel(time=index_time)
@@ -87,12 +122,12 @@ if dataFileList:
 	data = xr.decode_cf(data)
 	#
 
-	# simplistic spurious data filtering
-	#joyrad10 = joyrad10.where(joyrad10['Zg']>0)
-
-	
-	# correcting the range offset
-	data['range'] = data.range.values + rangeOffset
+	# correcting the range offset and the clock (see lagLib)
+	data['range'] = data.range.values + rangeOffset + rangeLag
+	timeShift = lag.interpTimeLag(timeLag, data.time.values)
+	if np.any(timeShift != 0):
+		data['time'] = data.time.values + np.rint(timeShift*1e9).astype('timedelta64[ns]')
+		data = data.sortby('time')
 
 	# resample along range
 	data = data.reindex({'range':rangeRef},method='nearest',tolerance=rangeTolerance)
@@ -108,20 +143,85 @@ if dataFileList:
 		data[var] = 10*np.log10(data[var])
 		data[var].attrs['units'] = 'dB'
 
+	# quality control: one mask for all moments, applied in place
+	# and stored as bitmask (qc_flag)
+	data = rspl.applyQCMask(data, 'Zg', var2proc, qcOptions.get(Band))
+
+	return data
+
+
+def writeData(data, dataPathOutput, date, Band):
+	"""
+	Saves the resampled data into a zlib compressed netCDF file
+
+	Parameters
+	----------
+	data: resampled xarray dataset (output from resampleData)
+	dataPathOutput: path where to put the resampled netcdf file
+	date: date of the resampled data (pandas Timestamp)
+	Band: either X or Ka
+
+	Returns
+	-------
+	outPutFileName: path of the written netcdf file
+	"""
 	# defining the final output path + name
-	outPutFileName = '{path}/{date}_mom_{band}-band.nc'.format(path=dataPathOutput,
-																		date=date.strftime('%Y%m%d'),band=Band)
-		     
+	outPutFileName = fl.getResampledFileName(Band, date, dataPathOutput)
+
 	# saving the resampled data into a netCDF file
 	print(outPutFileName)
-	# if we already have the file, sometimes it won't overwrite it, so just remove the already existing one
-	if os.path.exists(outPutFileName):
-		os.remove(outPutFileName)
-	encoding = {k:{'zlib': True} for k in data}
-	data.to_netcdf(outPutFileName,encoding=encoding)
-	data.close()
-	print('done with resampling')
-else:
-	print('no files found ', dateStr)
+	# same compression and chunks for all resampled files
+	encoding = rspl.getEncoding(data)
+	# the file may be written on a background thread (see resamplePlotPipeline.py)
+	with fl.netcdfLock:
+		# if we already have the file, sometimes it won't overwrite it, so just remove the already existing one
+		if os.path.exists(outPutFileName):
+			os.remove(outPutFileName)
+		data.to_netcdf(outPutFileName,encoding=encoding)
+
+	return outPutFileName
+
+
+def run(date, dataPath, dataPathOutput, Band, refBand=None):
+	"""
+	Resamples one day of X- or Ka-Band data and saves the resampled
+	data and their statistics
+
+	Parameters
+	----------
+	date: date that you want to have processed
+	dataPath: path where the radar data is stored
+	dataPathOutput: path where to put the resampled netcdf file
+	Band: either X or Ka
+	refBand: already resampled band (Ka or W) used to correct the
+		time lag and range offset (default: None, no correction)
+	"""
+	date = pd.to_datetime(date)
+	data = resampleData(date, dataPath, Band)
+	if data is not None and refBand is not None:
+		# estimating the time lag and range offset relative to the reference band
+		drift = lag.estimateBandDrift(dataPathOutput, date, Band, refBand, data)
+		if drift is not None:
+			# the clock drift is corrected with the per-hour lags, the range offset is constant
+			timeLags = lag.getTimeLags(drift)
+			timeLag, rangeLag = lag.getCorrection(drift)
+			if (timeLags.abs() >= minTimeLag).any() or abs(rangeLag) >= minRangeLag:
+				print('correcting time lag ',timeLag,' s (daily median) and range offset ',rangeLag,' m')
+				data = resampleData(date, dataPath, Band, timeLag=timeLags, rangeLag=rangeLag)
+	if data is not None:
+		writeData(data, dataPathOutput, date, Band)
+		# CFADs and mean profiles as small side product
+		stats = stl.calcStats(data, {var:stl.cfadBins[var] for var in statVars})
+		stl.writeStats(stats, rangeRef, stl.getStatsFileName(dataPathOutput, date, Band+'-band'))
+		data.close()
+		print('done with resampling')
+	return None
+
+
+if __name__ == '__main__':
+	scriptname, date,dataPath,dataPathOutput,Band = argv[:5] #, date,dataPath,dataPathOutput,Band
+	refBand = argv[5] if len(argv) > 5 else None
+	print(date)
 
+	run(date, dataPath, dataPathOutput, Band, refBand)
 
@@ -0,0 +1,231 @@
+#----------------------------
+# This script contains the functions used for
+# calculating the contoured frequency by altitude
+# diagrams (CFAD) and the mean profiles of the
+# resampled data
+# OPTIMIce Emmy-Noether Group
+# Institute for Geophysics and Meteorology
+# University of Cologne
+#----------------------------
+
+
+import numpy as np
+import xarray as xr
+import os
+import fileLib as fl
+
+
+# fixed bin edges of the CFADs, they have to stay the same for
+# all days so that the daily CFADs can be summed up
+cfadBins = {'Zg':np.arange(-60, 40.5, 1),
+            'VELg':np.arange(-6, 3.05, 0.1),
+            'DWR':np.arange(-10, 30.5, 0.5)}
+
+
+def initStats(varBins, rangeGrid):
+    """
+    Creates the empty accumulators of the CFADs and profile statistics
+
+    Parameters
+    ----------
+    varBins: dictionary of the variables and their bin edges
+    rangeGrid: range grid of the data (array[n])
+
+    Returns
+    -------
+    stats: dictionary with the histogram (bin, range) and the running
+        count, sum and sum of squares (range) of each variable
+
+    """
+
+    nRange = len(rangeGrid)
+    stats = {}
+    for var in varBins.keys():
+        bins = np.asarray(varBins[var], dtype=np.float64)
+        stats[var] = {'bins':bins,
+                      'hist':np.zeros((len(bins)-1, nRange), dtype=np.int64),
+                      'count':np.zeros(nRange, dtype=np.int64),
+                      'sum':np.zeros(nRange, dtype=np.float64),
+                      'sumSq':np.zeros(nRange, dtype=np.float64)}
+
+    return stats
+
+
+def updateStats(stats, var, values):
+    """
+    Adds data to the accumulators of one variable. The histogram
+    of all range gates is calculated with one bincount
+
+    Parameters
+    ----------
+    stats: output from initStats
+    var: variable name
+    values: the variable (array[time, range])
+
+    Returns
+    -------
+    no returned value, stats is updated in place
+
+    """
+
+    values = np.asarray(values, dtype=np.float64)
+    varStats = stats[var]
+    bins = varStats['bins']
+    nBins, nRange = varStats['hist'].shape
+
+    valid = np.isfinite(values)
+    validValues = np.where(valid, values, 0)
+    varStats['count'] += valid.sum(axis=0)
+    varStats['sum'] += validValues.sum(axis=0)
+    varStats['sumSq'] += (validValues**2).sum(axis=0)
+
+    binIndex = np.searchsorted(bins, values, side='right') - 1
+    # values equal to the last edge belong to the last bin
+    binIndex[values == bins[-1]] = nBins - 1
+    inBins = valid & (binIndex >= 0) & (binIndex < nBins)
+    rangeIndex = np.broadcast_to(np.arange(nRange), values.shape)
+    flatIndex = binIndex[inBins]*nRange + rangeIndex[inBins]
+    varStats['hist'] += np.bincount(flatIndex, minlength=nBins*nRange).reshape(nBins, nRange)
+
+    return None
+
+
+def calcStats(data, varBins, stats=None):
+    """
+    Calculates the CFADs and profile statistics of a resampled
+    dataset in one pass per variable (after the resampling)
+
+    Parameters
+    ----------
+    data: resampled xarray dataset (time, range)
+    varBins: dictionary of the variables and their bin edges
+    stats: accumulators to be updated (output from initStats),
+        if None new accumulators are created (default: None)
+
+    Returns
+    -------
+    stats: updated accumulators
+
+    """
+
+    if stats is None:
+        stats = initStats(varBins, data.range.values)
+
+    for var in varBins.keys():
+        updateStats(stats, var, data[var].transpose('time', 'range').values)
+
+    return stats
+
+
+def statsToDataset(stats, rangeGrid):
+    """
+    Converts the accumulators into a xarray dataset. Only sums are
+    stored so that several days can be added up (see combineStats)
+
+    Parameters
+    ----------
+    stats: output from initStats/calcStats
+    rangeGrid: range grid of the data (array[n])
+
+    Returns
+    -------
+    statsDS: xarray dataset with the variables {var}_cfad,
+        {var}_count, {var}_sum and {var}_sumSq
+
+    """
+
+    statsDS = xr.Dataset(coords={'range':rangeGrid})
+    for var in stats.keys():
+        bins = stats[var]['bins']
+        binDim = 'bin_'+var
+        statsDS.coords[binDim] = (bins[:-1] + bins[1:])/2
+        statsDS.coords[binDim+'_edges'] = bins
+        statsDS[var+'_cfad'] = ((binDim, 'range'), stats[var]['hist'])
+        statsDS[var+'_count'] = (('range',), stats[var]['count'])
+        statsDS[var+'_sum'] = (('range',), stats[var]['sum'])
+        statsDS[var+'_sumSq'] = (('range',), stats[var]['sumSq'])
+
+    return statsDS
+
+
+def getStatsFileName(dataPathOutput, date, name):
+    """
+    Defines the name of the daily statistics file
+
+    Parameters
+    ----------
+    dataPathOutput: path where the statistics are stored
+    date: date of the data (pandas Timestamp)
+    name: name of the product (e.g. X-band, DWR)
+
+    Returns
+    -------
+    outPutFileName: path of the statistics file
+
+    """
+
+    outPutFileName = '{path}/{date}_stats_{name}.nc'.format(path=dataPathOutput,
+                                                            date=date.strftime('%Y%m%d'),
+                                                            name=name)
+
+    return outPutFileName
+
+
+def writeStats(stats, rangeGrid, outPutFileName):
+    """
+    Saves the CFADs and profile statistics into a netCDF file
+
+    Parameters
+    ----------
+    stats: output from initStats/calcStats
+    rangeGrid: range grid of the data (array[n])
+    outPutFileName: path of the netCDF file
+
+    Returns
+    -------
+    no returned value
+
+    """
+
+    statsDS = statsToDataset(stats, rangeGrid)
+    print(outPutFileName)
+    encoding = {k:{'zlib': True} for k in statsDS}
+    # the statistics may be written on a background thread
+    with fl.netcdfLock:
+        if os.path.exists(outPutFileName):
+            os.remove(outPutFileName)
+        statsDS.to_netcdf(outPutFileName, encoding=encoding)
+
+    return None
+
+
+def combineStats(fileList):
+    """
+    Adds up the statistics of several days (e.g. a whole campaign)
+    and derives the mean and standard deviation profiles
+
+    Parameters
+    ----------
+    fileList: list of statistics files written by writeStats
+
+    Returns
+    -------
+    statsDS: summed xarray dataset including {var}_mean and {var}_std
+
+    """
+
+    statsDS = None
+    for filePath in fileList:
+        with xr.open_dataset(filePath) as dayDS:
+            dayDS = dayDS.load()
+        statsDS = dayDS if statsDS is None else statsDS + dayDS
+
+    if statsDS is None:
+        return None
+
+    for var in [name[:-len('_count')] for name in statsDS.data_vars if name.endswith('_count')]:
+        count = statsDS[var+'_count'].where(statsDS[var+'_count'] > 0)
+        statsDS[var+'_mean'] = statsDS[var+'_sum']/count
+        statsDS[var+'_std'] = np.sqrt(np.maximum(statsDS[var+'_sumSq']/count - statsDS[var+'_mean']**2, 0))
+
+    return statsDS
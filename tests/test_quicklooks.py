@@ -0,0 +1,44 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import quicklooks
+
+
+def testRefBandIsOtherBand():
+	# Ka resampled relative to the previous Ka file is rejected
+	with pytest.raises(SystemExit) as excInfo:
+		quicklooks.main(['resample', '20221206', 'in', 'out', 'Ka', '--ref-band', 'Ka'])
+	assert excInfo.value.code == 2
+
+
+def testProfileOnlyStageImports(capsys):
+	# only the libraries imported by the module of the step are reported
+	quicklooks.importStage('fileLib', profileImports=True)
+	report = capsys.readouterr().err
+	assert 'fileLib' in report
+	for name in quicklooks.heavyModules:
+		assert 'import '+name+' ' not in report
+
+
+def testProfileHeavyImports(tmp_path, monkeypatch, capsys):
+	# a heavy library imported by the step is reported, others are not
+	(tmp_path / 'fakeHeavyLib.py').write_text('x = 1\n')
+	(tmp_path / 'fakeStage.py').write_text('import fakeHeavyLib\n')
+	monkeypatch.syspath_prepend(str(tmp_path))
+	monkeypatch.setattr(quicklooks, 'heavyModules', ['fakeHeavyLib', 'fakeUnusedLib'])
+	quicklooks.importStage('fakeStage', profileImports=True)
+	report = capsys.readouterr().err
+	assert 'import fakeHeavyLib ' in report
+	assert 'fakeUnusedLib' not in report
+	assert 'import fakeStage ' in report
+
+
+def testResampledFileNames():
+	import datetime
+	import fileLib as fl
+	date = datetime.datetime(2022, 12, 6)
+	assert fl.getResampledFileList(date, 'out') == ['out/20221206_mom_X-band.nc', 'out/20221206_mom_Ka-band.nc',
+	                                                 'out/20221206_ZEN_moments_wband_scan.nc']
@@ -0,0 +1,122 @@
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+np = pytest.importorskip('numpy')
+xr = pytest.importorskip('xarray')
+pd = pytest.importorskip('pandas')
+pytest.importorskip('matplotlib')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import resamplePlotPipeline as rpp
+import resampleLib as rspl
+import resampleXKaBand as rsx
+import differenceLib as dfl
+import fileLib as fl
+
+
+def sumPlot(var, strDate, *args):
+	# stands in for tpp.plotMoment/plotDifference, writes the sums of the arrays
+	dataArrs, dataPathOutput = args[:-1], args[-1]
+	with open(os.path.join(dataPathOutput, var+'_'+strDate+'.txt'), 'w') as f:
+		f.write(' '.join(str(float(dataArr.sum())) for dataArr in dataArrs))
+
+
+def testPlotSharedInPool(tmp_path):
+	time = np.arange(10)
+	rangeGrid = np.arange(4)
+	dataList = {rad:xr.Dataset({'Zg':(('time', 'range'), np.full((10, 4), value))},
+	                           coords={'time':time, 'range':rangeGrid})
+	            for rad, value in [('rad10', 1.0), ('rad35', 2.0)]}
+	sharedInfo, shmList = rpp.shareVariables(dataList, {'rad10':['Zg'], 'rad35':['Zg']})
+	try:
+		with ProcessPoolExecutor(max_workers=2) as executor:
+			futures = [executor.submit(rpp.plotShared, sumPlot, var, '20221206', sharedInfo,
+			                           [('rad10', 'Zg'), ('rad35', 'Zg')], str(tmp_path))
+			           for var in ['Zg', 'VELg', 'RMSg']]
+			assert [future.result() for future in futures] == ['Zg', 'VELg', 'RMSg']
+	finally:
+		for shm in shmList:
+			shm.close()
+			shm.unlink()
+
+	for var in ['Zg', 'VELg', 'RMSg']:
+		assert (tmp_path / (var+'_20221206.txt')).read_text() == '40.0 80.0'
+
+
+def makeDay(value, nTime=150):
+	# resampled day on the reference range grid
+	return xr.Dataset({var:(('time', 'range'), np.full((nTime, len(rspl.rangeRef)), value))
+	                   for var in ['Zg', 'VELg', 'RMSg', 'SKWg']},
+	                  coords={'time':pd.date_range('2022-12-06', periods=nTime, freq='4s'),
+	                          'range':rspl.rangeRef})
+
+
+def testBackgroundWrites(tmp_path):
+	pytest.importorskip('netCDF4')
+	date = pd.to_datetime('20221206')
+	dataPathOutput = str(tmp_path)
+	readPaths = []
+	for i in range(4):
+		readPaths.append(str(tmp_path / 'read{0}.nc'.format(i)))
+		makeDay(float(i)).to_netcdf(readPaths[-1])
+
+	# same writer threads as resampleAndPlot
+	dataList = {'rad10':makeDay(1.0), 'rad35':makeDay(2.0), 'rad94':makeDay(4.0)}
+	offsets = {'offsetX':0.0, 'offsetKa':0.0, 'offsetW':0.0}
+	writers = []
+	for rad, Band in [('rad10', 'X'), ('rad35', 'Ka')]:
+		writers.append(threading.Thread(target=rsx.writeData, args=(dataList[rad], dataPathOutput, date, Band)))
+		writers[-1].start()
+	writers.append(threading.Thread(target=rpp.writeStatsProducts,
+	                                args=(dict(dataList), {'rad10':'X', 'rad35':'Ka'}, dataPathOutput, date)))
+	writers[-1].start()
+	diffData = dfl.calcDiffProducts(dataList, offsets)
+	writers.append(threading.Thread(target=rpp.writeDiffData,
+	                                args=(diffData, list(writers), date, dataPathOutput, offsets)))
+	writers[-1].start()
+
+	# meanwhile the main thread reads files as resampleAndPlot does
+	while any(writer.is_alive() for writer in writers):
+		for i, readPath in enumerate(readPaths):
+			with fl.netcdfLock:
+				data = xr.open_dataset(readPath)
+			data = rpp.loadData(data)
+			assert float(data['Zg'][0, 0]) == i
+	for writer in writers:
+		writer.join()
+
+	fileNames = ['20221206_mom_X-band.nc', '20221206_mom_Ka-band.nc', '20221206_stats_X-band.nc',
+	             '20221206_stats_DWR_XKa.nc', '20221206_diff_products.nc']
+	for fileName in fileNames:
+		with xr.open_dataset(str(tmp_path / fileName)) as data:
+			data.load()
+	with xr.open_dataset(str(tmp_path / '20221206_diff_products.nc')) as data:
+		assert float(data['DWR_XKa'][0, 0]) == -1.0
+		assert data.attrs['source'] == dfl.getSourceSignature(
+			[str(tmp_path / name) for name in ['20221206_mom_X-band.nc', '20221206_mom_Ka-band.nc',
+			                                   '20221206_ZEN_moments_wband_scan.nc']], offsets)
+		# same chunks as the moments
+		diffChunks = data['DWR_XKa'].encoding['chunksizes']
+	with xr.open_dataset(str(tmp_path / '20221206_mom_X-band.nc')) as data:
+		assert data['Zg'].encoding['chunksizes'] == diffChunks
+
+
+def testNoDiffFileWithoutBands(tmp_path):
+	# a day without any band file is calculated but not stored
+	date = pd.to_datetime('20221207')
+	dataList = {rad:makeDay(np.nan) for rad in ['rad10', 'rad35', 'rad94']}
+	offsets = {'offsetX':0.0, 'offsetKa':0.0, 'offsetW':0.0}
+	fileList = [str(tmp_path / name) for name in ['20221207_mom_X-band.nc', '20221207_mom_Ka-band.nc',
+	                                              '20221207_ZEN_moments_wband_scan.nc']]
+	diffData = dfl.getDiffProducts(date, str(tmp_path), dataList, offsets, fileList)
+	assert 'DWR_XKa' in diffData
+	assert not os.path.exists(dfl.getDiffFileName(str(tmp_path), date))
+
+
+def testPoolContext():
+	# the pools are not forked while writer threads may be inside HDF5
+	assert rspl.getPoolContext().get_start_method() in ['forkserver', 'spawn']
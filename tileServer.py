@@ -0,0 +1,338 @@
+#----------------------------
+# This script starts a local http server that renders map-like
+# tiles (time x height x zoom level) of the resampled data on
+# request. Rendered tiles are kept in an in-memory and an on-disk
+# LRU cache, the opened datasets in an in-memory LRU cache.
+#
+# tile url: http://localhost:PORT/tile/{date}/{variable}/{z}/{x}/{y}.png
+#   date: YYYYMMDD
+#   variable: moment and band (e.g. Zg_X, VELg_Ka, Zg_W) or a
+#       difference product (e.g. DWR_XKa, DDV_KaW)
+#   z: zoom level, the day and the height range are split into 2**z tiles
+#   x: time tile (0: start of the day), y: height tile (0: top)
+#
+# OPTIMIce Emmy-Noether Group
+# Institute for Geophysics and Meteorology
+# University of Cologne
+#----------------------------
+
+
+import matplotlib
+matplotlib.use('Agg')
+
+from sys import argv
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import os
+import re
+import threading
+import zlib
+import pandas as pd
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.colors import Normalize
+from PIL import Image
+import fileLib as fl
+import resampleLib as rspl
+import differenceLib as dfl
+import tripex_pol_plots as tpp
+
+'''
+input:
+dataPath: path where the resampled data are stored
+emptyDataPath: path to where there is a nc file with empty data in it
+port: optional, port of the server (default 8000)
+cacheDir: optional, directory of the on-disk tile cache (default dataPath/tileCache)
+'''
+
+tileSize = 256 # pixel
+maxZoom = 8
+maxTilesMemory = 2000 # number of tiles in the in-memory cache
+maxCacheBytes = 2*1024**3 # size of the on-disk tile cache
+maxDays = 4 # number of days of which the datasets are kept open
+cmap = 'nipy_spectral' # same colormap as the quicklooks
+
+# band of the moments and the radar name used by tripex_pol_plots
+bands = {'X':'rad10', 'Ka':'rad35', 'W':'rad94'}
+
+tileUrl = re.compile(r'^/tile/(\d{8})/(\w+)/(\d+)/(\d+)/(\d+)\.png$')
+
+
+class LRUCache(object):
+	"""
+	Thread-safe in-memory least recently used cache
+	"""
+
+	def __init__(self, maxItems):
+		self.maxItems = maxItems
+		self.items = OrderedDict()
+		self.lock = threading.Lock()
+
+	def get(self, key):
+		with self.lock:
+			if key not in self.items:
+				return None
+			self.items.move_to_end(key)
+			return self.items[key]
+
+	def put(self, key, value):
+		with self.lock:
+			self.items[key] = value
+			self.items.move_to_end(key)
+			while len(self.items) > self.maxItems:
+				self.items.popitem(last=False)
+
+
+class DiskTileCache(object):
+	"""
+	On-disk least recently used cache of the rendered tiles. The
+	modification time of a tile is updated when it is read, the
+	oldest tiles are removed when the cache exceeds maxBytes
+	"""
+
+	def __init__(self, cacheDir, maxBytes):
+		self.cacheDir = cacheDir
+		self.maxBytes = maxBytes
+		self.lock = threading.Lock()
+		self.size = sum(entry[2] for entry in self.listTiles())
+
+	def getPath(self, key):
+		return os.path.join(self.cacheDir, *[str(k) for k in key[:-1]], '{0}.png'.format(key[-1]))
+
+	def listTiles(self):
+		tiles = []
+		for root, dirs, files in os.walk(self.cacheDir):
+			for fileName in files:
+				filePath = os.path.join(root, fileName)
+				fileStat = os.stat(filePath)
+				tiles.append((fileStat.st_mtime, filePath, fileStat.st_size))
+		return tiles
+
+	def get(self, key):
+		filePath = self.getPath(key)
+		try:
+			with open(filePath, 'rb') as f:
+				tile = f.read()
+			os.utime(filePath)
+			return tile
+		except OSError:
+			return None
+
+	def put(self, key, tile):
+		filePath = self.getPath(key)
+		os.makedirs(os.path.dirname(filePath), exist_ok=True)
+		tmpPath = '{0}.{1}.tmp'.format(filePath, threading.get_ident())
+		with open(tmpPath, 'wb') as f:
+			f.write(tile)
+		os.replace(tmpPath, filePath)
+		with self.lock:
+			self.size += len(tile)
+			if self.size > self.maxBytes:
+				# removing the least recently used tiles down to 90 % of the limit
+				tiles = sorted(self.listTiles())
+				self.size = sum(entry[2] for entry in tiles)
+				for mtime, oldPath, size in tiles:
+					if self.size <= 0.9*self.maxBytes:
+						break
+					try:
+						os.remove(oldPath)
+						self.size -= size
+					except OSError:
+						pass
+
+
+class TileRenderer(object):
+	"""
+	Renders the tiles of the resampled data and keeps the caches
+	"""
+
+	def __init__(self, dataPath, emptyDataPath, cacheDir):
+		self.dataPath = dataPath
+		self.emptyDataPath = emptyDataPath
+		# evicted days are not closed explicitly, another thread may still
+		# read them, the files are closed when the datasets are released
+		self.days = LRUCache(maxDays)
+		self.dayLock = threading.Lock()
+		self.tiles = LRUCache(maxTilesMemory)
+		self.diskTiles = DiskTileCache(cacheDir, maxCacheBytes)
+		self.colorLimits = self.getColorLimits()
+
+	def getColorLimits(self):
+		# colormap limits of the quicklooks (variables dicts of tripex_pol_plots)
+		colorLimits = {}
+		for var in tpp.variables.keys():
+			vmin, vmax = tpp.variables[var]['vmin'], tpp.variables[var]['vmax']
+			for band in bands.keys():
+				colorLimits[var+'_'+band] = (min(vmin, vmax), max(vmin, vmax))
+		for var in tpp.diffVariables.keys():
+			for pair in dfl.radarPairs.keys():
+				name = tpp.diffVariables[var]['name']+'_'+pair
+				colorLimits[name] = (tpp.diffVariables[var]['vmin'], tpp.diffVariables[var]['vmax'])
+		return colorLimits
+
+	def getVersion(self, date):
+		# sizes and modification times of the band files and of the offset table
+		# (only os.stat), checked for every tile so that replaced files are noticed
+		fileList = tpp.getFileNames(date, self.dataPath) + [('/').join([self.dataPath, tpp.offsetFileName])]
+		signature = dfl.getSourceSignature(fileList, {})
+		return '{0:08x}'.format(zlib.crc32(signature.encode()))
+
+	def getDay(self, strDate):
+		date = pd.to_datetime(strDate)
+		version = self.getVersion(date)
+		dayData = self.days.get(strDate)
+		if dayData is not None and dayData['version'] == version:
+			return dayData
+		with self.dayLock:
+			dayData = self.days.get(strDate)
+			if dayData is None or dayData['version'] != version:
+				# the tiles are rendered on the threads of the server, the netCDF
+				# files are only opened, read and closed holding the netCDF lock
+				with fl.netcdfLock:
+					if dayData is not None:
+						# a band file or the offsets changed: closing removes the old files
+						# from the xarray file cache, so the replaced files are opened again
+						for name in ['rad10', 'rad35', 'rad94', 'diff']:
+							dayData[name].close()
+					data10, data35, data94 = tpp.openData(date, self.dataPath, self.emptyDataPath)
+					dataList = {'rad10':data10, 'rad35':data35, 'rad94':data94}
+					offsets = tpp.getOffsets(date, self.dataPath)
+					# the difference products are read from the daily file (or calculated once)
+					diffData = dfl.getDiffProducts(date, self.dataPath, dataList, offsets,
+					                               tpp.getFileNames(date, self.dataPath))
+				data10, data35, data94 = tpp.applyOffsets(data10, data35, data94, offsets)
+				# the rendered tiles are stored per input version
+				dayData = {'rad10':data10, 'rad35':data35, 'rad94':data94, 'diff':diffData,
+				           'version':version}
+				self.days.put(strDate, dayData)
+		return dayData
+
+	def getVariable(self, dayData, variable):
+		name, suffix = variable.rsplit('_', 1)
+		if suffix in bands:
+			return dayData[bands[suffix]][name]
+		return dayData['diff'][variable]
+
+	def render(self, dayData, strDate, variable, z, x, y):
+		"""
+		Renders one tile (png bytes), nearest neighbour of the
+		reference grid for each pixel
+		"""
+		dataArr = self.getVariable(dayData, variable).transpose('time', 'range')
+		nTiles = 2**z
+		# pixel centers of the tile (time in ns, range from the top)
+		pixel = (np.arange(tileSize) + 0.5)/tileSize
+		dayStart = pd.to_datetime(strDate).value
+		pixelTime = dayStart + ((x + pixel)/nTiles*pd.Timedelta(days=1).value).astype(np.int64)
+		rangeSpan = rspl.endRangeRef - rspl.beginRangeRef
+		pixelRange = rspl.endRangeRef - (y + pixel)/nTiles*rangeSpan
+
+		timeGrid = dataArr.time.values.astype('datetime64[ns]').astype(np.int64)
+		rangeGrid = dataArr.range.values
+		timeIndex = rspl.getNearestIndex(pixelTime, timeGrid, pd.Timedelta(rspl.timeTolerance).value)
+		rangeIndex = rspl.getNearestIndex(pixelRange, rangeGrid, rspl.rangeTolerance)
+
+		values = np.full((tileSize, tileSize), np.nan)
+		validTime = timeIndex >= 0
+		validRange = rangeIndex >= 0
+		if validTime.any() and validRange.any():
+			# only the part of the day covered by the tile is read
+			timeSlice = slice(timeIndex[validTime].min(), timeIndex[validTime].max()+1)
+			rangeSlice = slice(rangeIndex[validRange].min(), rangeIndex[validRange].max()+1)
+			with fl.netcdfLock:
+				block = dataArr.isel(time=timeSlice, range=rangeSlice).values
+			timeIndex = np.where(validTime, timeIndex - timeSlice.start, -1)
+			rangeIndex = np.where(validRange, rangeIndex - rangeSlice.start, -1)
+			values = rspl.getResampledVarIndexed(block, timeIndex, rangeIndex)
+
+		vmin, vmax = self.colorLimits[variable]
+		rgba = plt.get_cmap(cmap)(Normalize(vmin=vmin, vmax=vmax)(np.ma.masked_invalid(values.T)), bytes=True)
+		rgba[~np.isfinite(values.T)] = 0 # transparent where there is no data
+		buffer = io.BytesIO()
+		Image.fromarray(rgba, 'RGBA').save(buffer, format='PNG', compress_level=1)
+		return buffer.getvalue()
+
+	def getTile(self, strDate, variable, z, x, y):
+		dayData = self.getDay(strDate)
+		key = (strDate, dayData['version'], variable, z, x, y)
+		tile = self.tiles.get(key)
+		if tile is None:
+			tile = self.diskTiles.get(key)
+			if tile is None:
+				tile = self.render(dayData, strDate, variable, z, x, y)
+				self.diskTiles.put(key, tile)
+			self.tiles.put(key, tile)
+		return tile
+
+
+def makeHandler(renderer):
+
+	class TileHandler(BaseHTTPRequestHandler):
+
+		def do_GET(self):
+			match = tileUrl.match(self.path)
+			if match is None:
+				self.sendText(200 if self.path == '/' else 404,
+				              'tiles: /tile/{date}/{variable}/{z}/{x}/{y}.png\n'
+				              'variables: '+' '.join(sorted(renderer.colorLimits.keys()))+'\n')
+				return
+			strDate, variable = match.group(1), match.group(2)
+			z, x, y = [int(match.group(i)) for i in range(3, 6)]
+			if variable not in renderer.colorLimits or z > maxZoom or x >= 2**z or y >= 2**z:
+				self.sendText(404, 'unknown tile\n')
+				return
+			try:
+				tile = renderer.getTile(strDate, variable, z, x, y)
+			except Exception as error:
+				self.sendText(500, 'cannot render tile: {0}\n'.format(error))
+				return
+			self.send_response(200)
+			self.send_header('Content-Type', 'image/png')
+			self.send_header('Content-Length', str(len(tile)))
+			self.send_header('Cache-Control', 'max-age=3600')
+			self.end_headers()
+			self.wfile.write(tile)
+
+		def sendText(self, status, text):
+			body = text.encode()
+			self.send_response(status)
+			self.send_header('Content-Type', 'text/plain')
+			self.send_header('Content-Length', str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+
+	return TileHandler
+
+
+def serve(dataPath, emptyDataPath, port=8000, cacheDir=None):
+	"""
+	Starts the tile server on localhost
+
+	Parameters
+	----------
+	dataPath: path where the resampled data are stored
+	emptyDataPath: path to where there is a nc file with empty data in it
+	port: port of the server (default 8000)
+	cacheDir: directory of the on-disk tile cache (default dataPath/tileCache)
+	"""
+	if cacheDir is None:
+		cacheDir = os.path.join(dataPath, 'tileCache')
+	renderer = TileRenderer(dataPath, emptyDataPath, cacheDir)
+	server = ThreadingHTTPServer(('localhost', port), makeHandler(renderer))
+	print('serving tiles on http://localhost:{0}/'.format(port))
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+	return None
+
+
+if __name__ == '__main__':
+	scriptname, dataPath, emptyDataPath = argv[:3]
+	port = int(argv[3]) if len(argv) > 3 else 8000
+	cacheDir = argv[4] if len(argv) > 4 else None
+
+	serve(dataPath, emptyDataPath, port, cacheDir)
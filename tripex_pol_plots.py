@@ -1,6 +1,6 @@
 #----------------------------
-# This script is used for creating the plots.
-# Author: Jose Dias Neto 
+# This script is used for plotting the quicklooks of triple frequency setup
+# Author: Jose Dias Neto
 # OPTIMIce Emmy-Noether Group
 # Institute for Geophysics and Meteorology
 # University of Cologne
@@ -11,140 +11,294 @@ import matplotlib
 matplotlib.use('Agg')
 
 import matplotlib.pyplot as plt
-#----------------------------
-# This script is used for plotting the quicklooks of triple frequency setup
-# Author: Jose Dias Neto 
-# OPTIMIce Emmy-Noether Group
-# Institute for Geophysics and Meteorology
-# University of Cologne
-#----------------------------
-
-
 from sys import argv
 import pandas as pd
 import xarray as xr
 import numpy as np
 import plottingLib as plib
-import resampleLib as rsp
+import differenceLib as dfl
+import fileLib as fl
 import os
 
-scriptname, date, dataPath, dataPathOutput, emptyDataPath = argv #, date,dataPath,dataPathOutput,Band
-print(date)
-date = pd.to_datetime(date)
 '''
-input: 
+input:
 date: date that you want to have processed
 dataPath: path where the X-band data is stored
 dataPathOutput: path where to put the plot
 emptyDataPath: path to where there is a nc file with empty data in it
 '''
 
-#----------------------------
-# This is the main processing block for
-# for plotting the resampled data
-#
-
-print('plotting: {0}'.format(date))
-
-# trying to oppen the resampled joyrad10 data
-try:
-	fileName10 = date.strftime('%Y%m%d')+'_mom_X-band.nc'
-	filePath10 = ('/').join([dataPath, fileName10])
-	data10 = xr.open_dataset(filePath10)
-
-# reading an empty dataset in case joyrad10 does not exist
-except:
-	data10 = xr.open_dataset(emptyDataPath)
-	# time tolerance for detecting closest neighbour (seconds)
-	timeTolerance = '2S'
-	timeFreq = '4S'
-	timeRef = pd.date_range(date, date+pd.offsets.Day(1)-pd.offsets.Second(1), freq=timeFreq)
-	data10=data10.reindex({'time':timeRef},method='nearest',tolerance='1S')
-	print("couldn't open joyrad10 file at ", filePath10)
-	# trying to oppen the resampled joyrad10 data
-try:
-	fileName35 = date.strftime('%Y%m%d')+'_mom_Ka-band.nc'
-	filePath35 = ('/').join([dataPath, fileName35])
-	data35 = xr.open_dataset(filePath35)
+# time tolerance for detecting closest neighbour (seconds)
+timeTolerance = '2S'
+timeFreq = '4S'
+
+# table of the daily Ze offsets written by calibrateOffsets.py
+offsetFileName = 'dwr_offsets.csv'
+
+# names of the W-Band scan variables on the common grid
+renameWband = {'Ze':'Zg','MDV':'VELg','WIDTH':'RMSg','sLDR':'sLDR_w','SK':'SKWg'}
+
+# output format of the quicklooks (see plib.saveOptions), for the web page
+# a mid-size preview and a thumbnail are saved from the same rendered image
+saveOptions = {'format':'png', 'compressLevel':3, 'tightBBox':True,
+               'previews':{'preview':1200, 'thumb':300}}
 
-	# creating an empty dataset in case joyrad35 does not exist
-except:
-	data35 = xr.open_dataset(emptyDataPath)
-	timeTolerance = '2S'
-	timeFreq = '4S'
-	timeRef = pd.date_range(date, date+pd.offsets.Day(1)-pd.offsets.Second(1), freq=timeFreq)
-	data35=data35.reindex({'time':timeRef},method='nearest',tolerance='1S')
-	
-# trying to oppen the grarad94 orher 94 GHz radar
-try:
-	fileName94 = date.strftime('%Y%m%d')+'_ZEN_moments_wband_scan.nc'
-	filePath94 = ('/').join([dataPath, fileName94])
-	data94 = xr.open_dataset(filePath94)
-	data94 = data94.rename({'Ze':'Zg','MDV':'VELg','WIDTH':'RMSg','sLDR':'sLDR_w','SK':'SKWg'})
-# creating an empty dataset in case grarad does not exist
-except:
-	fileName94 = date.strftime('%Y%m%d')+'_ZEN_moments_wband_scan.nc'
-	filePath94 = ('/').join([dataPath, fileName94])
-	print('couldnt find data94 file at ',filePath94)
-	data94 =xr.open_dataset(emptyDataPath)
-	timeTolerance = '2S'
-	timeFreq = '4S'
-	timeRef = pd.date_range(date, date+pd.offsets.Day(1)-pd.offsets.Second(1), freq=timeFreq)
-	data94=data94.reindex({'time':timeRef},method='nearest',tolerance='1S')
-	
-#---------------------------------------
-# Use this block in case an Ze offset
-# correction is needed
-#
-#data10['Zg'] = data10['Zg'] + offsetX
-#data35['Zg'] = data35['Zg'] + offsetKa
-#data94['Zg'] = data94['Zg'] + offsetW
-#---------------------------------------
 # defining the variable and the color range
 # used by the plotting function
-print(data10)
-print(data35)
-print(data94)
-#quit()
 variables = {'Zg':{'vmax':25, 'vmin':-35,'units':'[dB]'},
              'VELg':{'vmax':0, 'vmin':-3,'units':r'[ms$^{-1}$]'},
              'RMSg':{'vmax':0, 'vmin':1,'units':r'[ms$^{-1}$]'},
              'SKWg':{'vmax':1, 'vmin':-1,'units':r'[]'},
             }
 
-# creating the triple panels plot
+# defining the color range and the name of the
+# differences used by the plotting function
+diffVariables = {'Zg':{'vmax':20, 'vmin':-5, 'name':'DWR','units':'[dB]'},
+                 'VELg':{'vmax':0.3, 'vmin':-0.3, 'name':'DDV','units':r'[ms$^{-1}$]'},
+                 'RMSg':{'vmax':0.3, 'vmin':-0.3, 'name':'DSW','units':r'[ms$^{-1}$]'}
+                }
+
+
+def openEmptyData(date, emptyDataPath):
+	"""
+	Opens the empty dataset and puts it onto the time grid of the day
+
+	Parameters
+	----------
+	date: plotting day (pandas Timestamp)
+	emptyDataPath: path to where there is a nc file with empty data in it
+
+	Returns
+	-------
+	data: empty xarray dataset on the time reference grid
+	"""
+	data = xr.open_dataset(emptyDataPath)
+	timeRef = pd.date_range(date, date+pd.offsets.Day(1)-pd.offsets.Second(1), freq=timeFreq)
+	data = data.reindex({'time':timeRef},method='nearest',tolerance='1S')
+	return data
+
+
+def getFileNames(date, dataPath):
+	"""
+	Defines the names of the resampled X-, Ka- and W-Band files (see fileLib)
+
+	Parameters
+	----------
+	date: plotting day (pandas Timestamp)
+	dataPath: path where the resampled data is stored
+
+	Returns
+	-------
+	filePath10, filePath35, filePath94: paths of the X-, Ka- and W-Band files
+	"""
+	return fl.getResampledFileList(date, dataPath)
+
+
+def openData(date, dataPath, emptyDataPath):
+	"""
+	Opens the resampled X-, Ka- and W-Band data of one day. If
+	a file does not exist the empty dataset is used instead
+
+	Parameters
+	----------
+	date: plotting day (pandas Timestamp)
+	dataPath: path where the resampled data is stored
+	emptyDataPath: path to where there is a nc file with empty data in it
+
+	Returns
+	-------
+	data10, data35, data94: xarray datasets of the X-, Ka- and W-Band
+	"""
+	filePath10, filePath35, filePath94 = getFileNames(date, dataPath)
+	# trying to oppen the resampled joyrad10 data
+	try:
+		data10 = xr.open_dataset(filePath10)
+	# reading an empty dataset in case joyrad10 does not exist
+	except:
+		data10 = openEmptyData(date, emptyDataPath)
+		print("couldn't open joyrad10 file at ", filePath10)
+
+	# trying to oppen the resampled joyrad35 data
+	try:
+		data35 = xr.open_dataset(filePath35)
+	# creating an empty dataset in case joyrad35 does not exist
+	except:
+		data35 = openEmptyData(date, emptyDataPath)
+
+	# trying to oppen the grarad94 orher 94 GHz radar
+	try:
+		data94 = xr.open_dataset(filePath94)
+		data94 = data94.rename(renameWband)
+	# creating an empty dataset in case grarad does not exist
+	except:
+		print('couldnt find data94 file at ',filePath94)
+		data94 = openEmptyData(date, emptyDataPath)
+
+	return data10, data35, data94
+
+
+def getOffsets(date, dataPath):
+	"""
+	Reads the Ze offsets of one day from the offset table. Days
+	without table entry or without estimated offset get 0 dB
+
+	Parameters
+	----------
+	date: plotting day (pandas Timestamp)
+	dataPath: path where the offset table is stored
+
+	Returns
+	-------
+	offsets: dictionary of the offsets (offsetX, offsetKa, offsetW)
+	"""
+	offsets = {'offsetX':0.0, 'offsetKa':0.0, 'offsetW':0.0}
+	filePath = ('/').join([dataPath, offsetFileName])
+	if os.path.exists(filePath):
+		offsetTable = pd.read_csv(filePath, index_col='date', dtype={'date':str})
+		if date.strftime('%Y%m%d') in offsetTable.index:
+			for offset in offsets.keys():
+				value = offsetTable.loc[date.strftime('%Y%m%d'), offset]
+				if np.isfinite(value):
+					offsets[offset] = float(value)
+	return offsets
 
-for var in variables.keys():
 
-	plib.plotVar(data35[var], data94[var],
+def applyOffsets(data10, data35, data94, offsets):
+	"""
+	Applies the Ze offsets to the Zg of the three radars
+
+	Parameters
+	----------
+	data10, data35, data94: xarray datasets of the X-, Ka- and W-Band
+	offsets: output from getOffsets
+
+	Returns
+	-------
+	data10, data35, data94: offset corrected datasets (the input
+		datasets are not changed)
+	"""
+	corrected = []
+	for data, offset in [(data10, 'offsetX'), (data35, 'offsetKa'), (data94, 'offsetW')]:
+		if offsets[offset] != 0:
+			# shallow copy, the uncorrected dataset may still be written to disk
+			data = data.copy(deep=False)
+			data['Zg'] = data['Zg'] + offsets[offset]
+			print('applied ',offset,offsets[offset])
+		corrected.append(data)
+	return tuple(corrected)
+
+
+def plotMoment(var, strDate, data10, data35, data94, dataPathOutput):
+	"""
+	Creates the triple panel plot of one radar moment
+
+	Parameters
+	----------
+	var: name of the moment (key of variables)
+	strDate: plotting day (str, %Y%m%d)
+	data10, data35, data94: xarray dataarrays of the moment for X-, Ka- and W-Band
+	dataPathOutput: path where to put the plot
+	"""
+	plib.plotVar(data35, data94,
 		    variables[var]['vmax'], variables[var]['vmin'],
-		    dataPathOutput, date.strftime('%Y%m%d'), var,variables[var]['units'],CEL=False,data10=data10[var])
+		    dataPathOutput, strDate, var,variables[var]['units'],CEL=False,data10=data10,
+		    options=saveOptions)
 	print(var,' plotted ZEN')
 
-# creating LDR plot
 
-#plib.plotLDR(data35, -20, -35, dataPathOutput, date.strftime('%Y%m%d'), 'LDR_ka')
-#print('ZEN LDR plotted')
+def plotDifference(var, strDate, diff1035, diff3594, dataPathOutput):
+	"""
+	Creates the dual panel difference plot of one radar moment
 
-# defining the color range and the name of the
-# differences used by the plotting function
-variables = {'Zg':{'vmax':20, 'vmin':-5, 'name':'DWR','units':'[dB]'},
-             'VELg':{'vmax':0.3, 'vmin':-0.3, 'name':'DDV','units':r'[ms$^{-1}$]'},
-             'RMSg':{'vmax':0.3, 'vmin':-0.3, 'name':'DSW','units':r'[ms$^{-1}$]'}
-            }
+	Parameters
+	----------
+	var: name of the moment (key of diffVariables)
+	strDate: plotting day (str, %Y%m%d)
+	diff1035, diff3594: xarray dataarrays of the X-Ka and Ka-W difference
+	dataPathOutput: path where to put the plot
+	"""
+	diff1035.attrs['long_name']=diffVariables[var]['name']+'-XKa'
+	diff3594.attrs['long_name']=diffVariables[var]['name']+'-KaW'
 
-# creating the difference plots
-for var in variables.keys():
-	diff1035 = data10[var] - data35[var]
-	diff3594 = data35[var] - data94[var]
+	plib.plotDiffVar(diff3594,
+		        diffVariables[var]['vmax'], diffVariables[var]['vmin'],
+		        dataPathOutput, strDate, diffVariables[var]['name'],diffVariables[var]['units'],CEL=False,diff1035=diff1035,
+		        options=saveOptions)
 
-	diff1035.attrs['long_name']=variables[var]['name']+'-XKa'
-	diff3594.attrs['long_name']=variables[var]['name']+'-KaW'
 
-	plib.plotDiffVar(diff3594,
-		        variables[var]['vmax'], variables[var]['vmin'],
-		        dataPathOutput, date.strftime('%Y%m%d') , variables[var]['name'],variables[var]['units'],CEL=False,diff1035=diff1035)
-print('plotted difference variable ZEN')
-# closing all files
+def plotQuicklooks(date, data10, data35, data94, diffData, dataPathOutput):
+	"""
+	Creates all moment and difference quicklooks of one day
+
+	Parameters
+	----------
+	date: plotting day (pandas Timestamp)
+	data10, data35, data94: xarray datasets of the X-, Ka- and W-Band
+	diffData: xarray dataset of the difference products (see differenceLib)
+	dataPathOutput: path where to put the plot
+	"""
+	strDate = date.strftime('%Y%m%d')
+	# creating the triple panels plot
+	for var in variables.keys():
+		plotMoment(var, strDate, data10[var], data35[var], data94[var], dataPathOutput)
+
+	# creating LDR plot
+
+	#plib.plotLDR(data35, -20, -35, dataPathOutput, strDate, 'LDR_ka')
+	#print('ZEN LDR plotted')
+
+	# creating the difference plots
+	for var in diffVariables.keys():
+		name = diffVariables[var]['name']
+		plotDifference(var, strDate, diffData[name+'_XKa'], diffData[name+'_KaW'], dataPathOutput)
+	print('plotted difference variable ZEN')
+
+
+def run(date, dataPath, dataPathOutput, emptyDataPath):
+	"""
+	Plots all quicklooks of one day from the resampled files
+
+	Parameters
+	----------
+	date: date that you want to have processed
+	dataPath: path where the resampled data is stored
+	dataPathOutput: path where to put the plot
+	emptyDataPath: path to where there is a nc file with empty data in it
+	"""
+	date = pd.to_datetime(date)
+
+	#----------------------------
+	# This is the main processing block for
+	# for plotting the resampled data
+	#
+
+	print('plotting: {0}'.format(date))
+	data10, data35, data94 = openData(date, dataPath, emptyDataPath)
+
+	#---------------------------------------
+	# Ze offset correction, the offsets are
+	# estimated with calibrateOffsets.py
+	#
+	offsets = getOffsets(date, dataPath)
+	# the difference products are only recalculated if a band file or an offset changed
+	diffData = dfl.getDiffProducts(date, dataPath, {'rad10':data10, 'rad35':data35, 'rad94':data94},
+	                               offsets, getFileNames(date, dataPath))
+	data10, data35, data94 = applyOffsets(data10, data35, data94, offsets)
+	#---------------------------------------
+	print(data10)
+	print(data35)
+	print(data94)
+
+	plotQuicklooks(date, data10, data35, data94, diffData, dataPathOutput)
+	# closing all files
+	for data in [data10, data35, data94, diffData]:
+		data.close()
+	return None
+
+
+if __name__ == '__main__':
+	scriptname, date, dataPath, dataPathOutput, emptyDataPath = argv #, date,dataPath,dataPathOutput,Band
+	print(date)
+
+	run(date, dataPath, dataPathOutput, emptyDataPath)
 
- 
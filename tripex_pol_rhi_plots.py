@@ -0,0 +1,77 @@
+#----------------------------
+# This script is used for plotting all RHI scans of one day
+# OPTIMIce Emmy-Noether Group
+# Institute for Geophysics and Meteorology
+# University of Cologne
+#----------------------------
+
+
+import matplotlib
+matplotlib.use('Agg')
+
+from sys import argv
+import pandas as pd
+import xarray as xr
+import fileLib as fl
+import plottingLib as plib
+import resampleLib as rsp
+
+'''
+input:
+date: date that you want to have processed
+dataPath: path where the RHI scan files are stored (one scan per file)
+dataPathOutput: path where to put the plots
+'''
+
+# defining the variables, color range and colormap of the RHI plots
+rhiVariables = {'Zg':{'lim':(-35,25), 'cmap':'nipy_spectral', 'cbLabel':'Zg [dB]'},
+                'ZDR':{'lim':(-1,4), 'cmap':'gist_ncar', 'cbLabel':'ZDR [dB]'},
+                'KDP':{'lim':(-1,4), 'cmap':'gist_ncar', 'cbLabel':r'KDP [°km$^{-1}$]'},
+                'RHV':{'lim':(0.85,1.001), 'cmap':'gist_ncar_r', 'cbLabel':'RhoHV'}}
+
+
+def readScan(filePath):
+	"""
+	Reads one RHI scan into memory (on the prefetch threads)
+	"""
+	# netCDF-C/HDF5 are not thread-safe, the reading threads take turns
+	with fl.netcdfLock:
+		with xr.open_dataset(filePath) as data:
+			return data.load()
+
+
+def plotDay(date, dataPath, dataPathOutput):
+	"""
+	Plots all variables of all RHI scans of one day
+
+	Parameters
+	----------
+	date: plotting day (pandas Timestamp)
+	dataPath: path where the RHI scan files are stored
+	dataPathOutput: path where to put the plots
+	"""
+	dataFileList = fl.getFileList(fl.rhiFilePattern, date, dataPath)
+	if not dataFileList:
+		print('no files found ', date.strftime('%Y%m%d'))
+		return None
+
+	def scans():
+		# the next scans are read while the current one is plotted
+		for f, data, error in rsp.prefetchFiles(dataFileList, readScan):
+			if error is not None:
+				print('cannot open ',f)
+				continue
+			yield data
+
+	plib.plotRHIs(scans(), rhiVariables, dataPathOutput)
+	print('plotted RHIs')
+	return None
+
+
+if __name__ == '__main__':
+	scriptname, date, dataPath, dataPathOutput = argv
+	print(date)
+	date = pd.to_datetime(date)
+
+	plotDay(date, dataPath, dataPathOutput)
+